@@ -6,13 +6,17 @@ Telegram бот с интеграцией OpenAI
 import asyncio
 import logging
 import sys
+from collections import OrderedDict
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import GetUpdates
 
 from config import BOT_TOKEN
-from handlers import router
+from handlers import router, close_http_session
+from openai_client import close_client
 
 
 # Настройка логирования
@@ -24,6 +28,69 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class RateLimiter:
+    """Ограничитель частоты: не больше rate вызовов за period секунд (допускает всплеск до rate)"""
+    
+    def __init__(self, rate: float, period: float = 1.0):
+        self._interval = period / rate
+        self._tolerance = period - self._interval
+        self._tat = 0.0
+    
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        tat = max(self._tat, now)
+        self._tat = tat + self._interval
+        delay = tat - now - self._tolerance
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def is_idle(self, now: float) -> bool:
+        """Ограничитель ничего не помнит о прошлых вызовах - его можно создать заново"""
+        return now >= self._tat
+
+
+class ThrottleMiddleware(BaseRequestMiddleware):
+    """
+    Равномерно распределяет исходящие запросы к Bot API, чтобы не упираться в 429.
+    Лимиты Telegram: ~30 сообщений/с на бота и 20 сообщений/мин в одну группу.
+    """
+    
+    def __init__(self, rate: float = 28, group_rate: float = 18, max_groups: int = 1024):
+        self._limiter = RateLimiter(rate, 1)
+        self._group_rate = group_rate
+        self._max_groups = max_groups
+        # LRU по чатам: сверх max_groups удаляем самые давние простаивающие ограничители
+        self._group_limiters: "OrderedDict[int, RateLimiter]" = OrderedDict()
+    
+    async def __call__(self, make_request, bot, method):
+        # Long polling не расходует лимит на отправку сообщений
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(chat_id, int) and chat_id < 0:
+            limiter = self._group_limiters.get(chat_id)
+            if limiter is None:
+                limiter = self._group_limiters[chat_id] = RateLimiter(self._group_rate, 60)
+                self._prune_group_limiters()
+            else:
+                self._group_limiters.move_to_end(chat_id)
+            await limiter.acquire()
+        
+        await self._limiter.acquire()
+        return await make_request(bot, method)
+    
+    def _prune_group_limiters(self) -> None:
+        now = asyncio.get_running_loop().time()
+        while len(self._group_limiters) > self._max_groups:
+            chat_id, limiter = next(iter(self._group_limiters.items()))
+            # Активный ограничитель не трогаем - иначе группа обойдёт лимит
+            if not limiter.is_idle(now):
+                break
+            del self._group_limiters[chat_id]
+
+
 async def main() -> None:
     """Главная функция запуска бота"""
     
@@ -39,6 +106,9 @@ async def main() -> None:
         default=DefaultBotProperties()
     )
     
+    # Общий троттлинг всех исходящих запросов
+    bot.session.middleware(ThrottleMiddleware())
+    
     # Создаем диспетчер с хранилищем состояний
     dp = Dispatcher(storage=MemoryStorage())
     
@@ -55,6 +125,8 @@ async def main() -> None:
     try:
         await dp.start_polling(bot)
     finally:
+        await close_http_session()
+        await close_client()
         await bot.session.close()
 
 
@@ -62,6 +134,13 @@ if __name__ == "__main__":
     # Исправление для Windows
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    else:
+        # uvloop заметно быстрее стандартного цикла; если не установлен - работаем без него
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
     
     try:
         asyncio.run(main())
@@ -23,6 +23,17 @@ OPENAI_VISION_MODEL = "gpt-4o"
 # Модель для генерации изображений (DALL-E 3 - последняя версия)
 IMAGE_MODEL = "dall-e-3"
 
+# Локальное распознавание голоса через faster-whisper (pip install faster-whisper).
+# Пустая строка - используем Whisper API OpenAI.
+# Пример: "small" (устройство "cuda" + "int8_float16" или "cpu" + "int8")
+LOCAL_WHISPER_MODEL = ""
+LOCAL_WHISPER_DEVICE = "auto"
+LOCAL_WHISPER_COMPUTE_TYPE = "int8"
+
+# Каталог дискового кэша ответов модели и распознавания голоса (pip install diskcache).
+# Кэш переживает перезапуск бота. Пустая строка - только кэш в памяти.
+LLM_CACHE_DIR = ""
+
 # Максимальное количество токенов в ответе
 MAX_TOKENS = 110000
 
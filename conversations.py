@@ -3,6 +3,7 @@
 Хранит историю сообщений для каждой беседы и настройки пользователя
 """
 
+import hashlib
 import json
 import os
 from dataclasses import dataclass, field
@@ -114,6 +115,10 @@ class ConversationManager:
     
     def get_user_model(self, user_id: int) -> str:
         """Получает выбранную модель пользователя"""
+        # Данные пользователя уже в памяти - файл не трогаем
+        model = self._user_models.get(user_id)
+        if model is not None:
+            return model
         self._load_user_data(user_id)
         return self._user_models.get(user_id, DEFAULT_MODEL)
     
@@ -198,6 +203,8 @@ class ConversationManager:
         if not enabled:
             self._template_docs.pop(user_id, None)
             self._template_names.pop(user_id, None)
+            if hasattr(self, '_template_structures'):
+                self._template_structures.pop(user_id, None)
     
     def get_template_doc(self, user_id: int) -> Optional[bytes]:
         """Получает сохранённый шаблон документа"""
@@ -219,6 +226,21 @@ class ConversationManager:
             self._template_names = {}
         self._template_docs[user_id] = doc_bytes
         self._template_names[user_id] = filename
+        # Документ изменился - структура для AI устарела
+        if hasattr(self, '_template_structures'):
+            self._template_structures.pop(user_id, None)
+    
+    def get_template_structure(self, user_id: int) -> Optional[str]:
+        """Получает разобранную структуру текущего шаблона (если уже извлекалась)"""
+        if not hasattr(self, '_template_structures'):
+            self._template_structures = {}
+        return self._template_structures.get(user_id)
+    
+    def set_template_structure(self, user_id: int, structure: str) -> None:
+        """Сохраняет структуру текущего шаблона, чтобы не разбирать DOCX на каждый запрос"""
+        if not hasattr(self, '_template_structures'):
+            self._template_structures = {}
+        self._template_structures[user_id] = structure
 
     # ===== Методы для кастомных промптов =====
     
@@ -362,6 +384,7 @@ class ConversationManager:
         
         if user_id in self._conversations and conv_id in self._conversations[user_id]:
             del self._conversations[user_id][conv_id]
+            self._drop_history_hasher(user_id, conv_id)
             
             # Если удалили активную беседу, сбрасываем
             if self._active_conversations.get(user_id) == conv_id:
@@ -377,27 +400,72 @@ class ConversationManager:
         
         if user_id in self._conversations and conv_id in self._conversations[user_id]:
             self._conversations[user_id][conv_id].messages = []
+            self._drop_history_hasher(user_id, conv_id)
             self._save_user_data(user_id)
             return True
         return False
     
     def add_message(self, user_id: int, role: str, content: str, max_messages: int = 20) -> None:
         """Добавляет сообщение в активную беседу"""
+        self.add_messages(user_id, [(role, content)], max_messages)
+    
+    def add_messages(self, user_id: int, messages: List[tuple], max_messages: int = 20) -> None:
+        """Добавляет несколько сообщений (role, content) в активную беседу с одним сохранением"""
         self._load_user_data(user_id)
         
         conv = self.get_active_conversation(user_id)
         if not conv:
             conv = self.create_conversation(user_id)
         
-        message = Message(role=role, content=content)
-        conv.messages.append(message)
+        conv.messages.extend(Message(role=role, content=content) for role, content in messages)
+        
+        # Дописываем новые сообщения в хэш истории (если он уже считался)
+        hasher = getattr(self, '_history_hashers', {}).get((user_id, conv.id))
+        if hasher is not None:
+            for role, content in messages:
+                self._feed_history_hasher(hasher, role, content)
         
-        # Ограничиваем количество сообщений
+        # Ограничиваем количество сообщений (удаляем старые на месте, без копии списка)
         if len(conv.messages) > max_messages:
-            conv.messages = conv.messages[-max_messages:]
+            del conv.messages[:-max_messages]
         
         self._save_user_data(user_id)
     
+    @staticmethod
+    def _feed_history_hasher(hasher, role: str, content: str) -> None:
+        hasher.update(role.encode("utf-8"))
+        hasher.update(b"\0")
+        hasher.update(content.encode("utf-8"))
+        hasher.update(b"\0")
+    
+    def _drop_history_hasher(self, user_id: int, conv_id: str) -> None:
+        if hasattr(self, '_history_hashers'):
+            self._history_hashers.pop((user_id, conv_id), None)
+    
+    def get_history_digest(self, user_id: int) -> Optional[str]:
+        """
+        Получает хэш истории активной беседы для ключа кэша ответов.
+        
+        Хэш обновляется по мере добавления сообщений, поэтому не требует
+        повторного прохода по всей истории. Он зависит от всех добавленных
+        сообщений, включая уже вытесненные лимитом.
+        """
+        conv = self.get_active_conversation(user_id)
+        if not conv:
+            return None
+        
+        if not hasattr(self, '_history_hashers'):
+            self._history_hashers = {}
+        key = (user_id, conv.id)
+        hasher = self._history_hashers.get(key)
+        if hasher is None:
+            # Первое обращение (например, после перезапуска) - считаем по сохранённой истории
+            hasher = hashlib.blake2b(digest_size=16)
+            for msg in conv.messages:
+                self._feed_history_hasher(hasher, msg.role, msg.content)
+            self._history_hashers[key] = hasher
+        return hasher.hexdigest()
+    
     def get_messages_for_api(self, user_id: int, system_prompt: str) -> List[dict]:
         """Получает сообщения в формате OpenAI API"""
         conv = self.get_active_conversation(user_id)
@@ -405,8 +473,7 @@ class ConversationManager:
         messages = [{"role": "system", "content": system_prompt}]
         
         if conv:
-            for msg in conv.messages:
-                messages.append({"role": msg.role, "content": msg.content})
+            messages.extend({"role": msg.role, "content": msg.content} for msg in conv.messages)
         
         return messages
     
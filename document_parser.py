@@ -3,70 +3,98 @@
 """
 
 import io
+import asyncio
 from typing import Optional
 
 from docx import Document
 import fitz  # PyMuPDF
 
 
-async def extract_text_from_docx(file_data: bytes) -> str:
+def _read_docx_text(file_data: bytes, max_chars: Optional[int] = None) -> str:
+    doc = Document(io.BytesIO(file_data))
+    text_parts = []
+    total = 0
+    
+    for paragraph in doc.paragraphs:
+        if paragraph.text.strip():
+            text_parts.append(paragraph.text)
+            total += len(paragraph.text) + 1
+            # Дальше текст всё равно будет обрезан - не читаем лишнее
+            if max_chars is not None and total > max_chars:
+                return "\n".join(text_parts)
+    
+    # Также извлекаем текст из таблиц
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = []
+            for cell in row.cells:
+                if cell.text.strip():
+                    row_text.append(cell.text.strip())
+            if row_text:
+                line = " | ".join(row_text)
+                text_parts.append(line)
+                total += len(line) + 1
+                if max_chars is not None and total > max_chars:
+                    return "\n".join(text_parts)
+    
+    return "\n".join(text_parts)
+
+
+async def extract_text_from_docx(file_data: bytes, max_chars: Optional[int] = None) -> str:
     """
     Извлекает текст из DOCX файла.
     
     Args:
         file_data: Байты файла DOCX
+        max_chars: Прекратить чтение, как только текст превысит этот размер
         
     Returns:
         Извлеченный текст
     """
     try:
-        doc = Document(io.BytesIO(file_data))
-        text_parts = []
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_parts.append(paragraph.text)
-        
-        # Также извлекаем текст из таблиц
-        for table in doc.tables:
-            for row in table.rows:
-                row_text = []
-                for cell in row.cells:
-                    if cell.text.strip():
-                        row_text.append(cell.text.strip())
-                if row_text:
-                    text_parts.append(" | ".join(row_text))
-        
-        return "\n".join(text_parts)
+        # Разбор XML занимает заметное время - выполняем в отдельном потоке
+        return await asyncio.to_thread(_read_docx_text, file_data, max_chars)
     except Exception as e:
         return f"Ошибка при чтении DOCX: {str(e)}"
 
 
-async def extract_text_from_pdf(file_data: bytes) -> str:
+def _read_pdf_text(file_data: bytes, max_chars: Optional[int] = None) -> str:
+    text_parts = []
+    total = 0
+    
+    # Открываем PDF из байтов
+    pdf_document = fitz.open(stream=file_data, filetype="pdf")
+    
+    for page_num in range(len(pdf_document)):
+        page = pdf_document[page_num]
+        text = page.get_text()
+        if text.strip():
+            part = f"--- Страница {page_num + 1} ---\n{text}"
+            text_parts.append(part)
+            total += len(part) + 2
+            # Остальные страницы всё равно не попадут в обрезанный текст
+            if max_chars is not None and total > max_chars:
+                break
+    
+    pdf_document.close()
+    
+    return "\n\n".join(text_parts)
+
+
+async def extract_text_from_pdf(file_data: bytes, max_chars: Optional[int] = None) -> str:
     """
     Извлекает текст из PDF файла.
     
     Args:
         file_data: Байты файла PDF
+        max_chars: Прекратить чтение, как только текст превысит этот размер
         
     Returns:
         Извлеченный текст
     """
     try:
-        text_parts = []
-        
-        # Открываем PDF из байтов
-        pdf_document = fitz.open(stream=file_data, filetype="pdf")
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            text = page.get_text()
-            if text.strip():
-                text_parts.append(f"--- Страница {page_num + 1} ---\n{text}")
-        
-        pdf_document.close()
-        
-        return "\n\n".join(text_parts)
+        # Извлечение текста постранично - CPU-работа, выполняем в отдельном потоке
+        return await asyncio.to_thread(_read_pdf_text, file_data, max_chars)
     except Exception as e:
         return f"Ошибка при чтении PDF: {str(e)}"
 
@@ -94,13 +122,17 @@ async def extract_text_from_txt(file_data: bytes) -> str:
     return file_data.decode('utf-8', errors='replace')
 
 
-async def extract_text_from_file(file_data: bytes, file_name: str) -> Optional[str]:
+async def extract_text_from_file(
+    file_data: bytes, file_name: str, max_chars: Optional[int] = None
+) -> Optional[str]:
     """
     Определяет тип файла и извлекает текст.
     
     Args:
         file_data: Байты файла
         file_name: Имя файла
+        max_chars: Ограничение на объём извлекаемого текста (для DOCX и PDF
+            чтение останавливается сразу после превышения лимита)
         
     Returns:
         Извлеченный текст или None, если формат не поддерживается
@@ -108,9 +140,9 @@ async def extract_text_from_file(file_data: bytes, file_name: str) -> Optional[s
     file_name_lower = file_name.lower()
     
     if file_name_lower.endswith('.docx'):
-        return await extract_text_from_docx(file_data)
+        return await extract_text_from_docx(file_data, max_chars)
     elif file_name_lower.endswith('.pdf'):
-        return await extract_text_from_pdf(file_data)
+        return await extract_text_from_pdf(file_data, max_chars)
     elif file_name_lower.endswith('.txt'):
         return await extract_text_from_txt(file_data)
     else:
@@ -193,8 +225,7 @@ async def edit_docx_with_replacements(file_data: bytes, replacements: dict) -> b
     # Сохраняем в байты
     output = io.BytesIO()
     doc.save(output)
-    output.seek(0)
-    return output.read()
+    return output.getvalue()
 
 
 async def get_docx_structure_for_ai(file_data: bytes) -> str:
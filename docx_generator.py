@@ -4,6 +4,8 @@
 """
 
 import io
+import re
+import threading
 import markdown
 from typing import Optional
 import markdown
@@ -12,6 +14,25 @@ from docx.oxml.shared import OxmlElement
 from docx.oxml.ns import qn
 from htmldocx import HtmlToDocx
 
+# "1. Текст" в начале строки (нумерация, которую экранируем)
+_LIST_NUMBER_RE = re.compile(r'^(\s*)(\d+)\.')
+# Заголовок Markdown "# ..." - "###### ..."
+_HEADER_RE = re.compile(r'^\s*#{1,6}\s')
+# Символы строки-разделителя таблицы "|---|:--:|"
+_TABLE_SEP_CHARS = frozenset("|-: ")
+
+# Экземпляр Markdown с загруженными расширениями создаётся один раз на поток
+# (объект хранит состояние разбора, поэтому между потоками его не делим)
+_MARKDOWN_EXTENSIONS = ['tables', 'extra', 'fenced_code', 'nl2br']
+_markdown_local = threading.local()
+
+
+def _get_markdown() -> markdown.Markdown:
+    md = getattr(_markdown_local, 'md', None)
+    if md is None:
+        md = _markdown_local.md = markdown.Markdown(extensions=_MARKDOWN_EXTENSIONS)
+    return md
+
 def create_list_numbering(doc, abstract_num_id=1):
     """
     Creates a new numbering definition (w:num) that points to the given abstractNumId.
@@ -138,28 +159,28 @@ def convert_markdown_to_docx(markdown_text: str) -> bytes:
         Байты сгенерированного DOCX файла
     """
     # 0. Препроцессинг текста
-    import re
-    
     lines = markdown_text.split('\n')
+    # strip() каждой строки считаем один раз - соседние строки проверяются многократно
+    stripped = [line.strip() for line in lines]
     fixed_lines = []
     
     for i, line in enumerate(lines):
         # 1. Отключение распознавания списков: экранируем точку после номера
         # Превращаем "1. Текст" в "1\. Текст". Markdown не поймет это как список,
         # и htmldocx просто выведет это как параграф текста "1. Текст".
-        line = re.sub(r'^(\s*)(\d+)\.', r'\1\2\\.', line)
+        line = _LIST_NUMBER_RE.sub(r'\1\2\\.', line)
         
         # 2. Исправление таблиц
         # Если строка похожа на начало таблицы (содержит | и не пустая), а предыдущая не пустая - добавляем отступ
-        if "|" in line and i > 0 and lines[i-1].strip() and not lines[i-1].strip().startswith("|"):
+        if "|" in line and i > 0 and stripped[i-1] and not stripped[i-1].startswith("|"):
              # Проверяем, что это действительно таблица (наличие разделителя ---|--- на следующей строке)
-             if i + 1 < len(lines) and set(lines[i+1].strip()) <= set("|-:| "):
+             if i + 1 < len(lines) and _TABLE_SEP_CHARS.issuperset(stripped[i+1]):
                  fixed_lines.append("")
         
         # 3. Нормализация заголовков
         # Markdown требует пустую строку перед заголовком. Если её нет, заголовок может не распознаться.
         # Если строка начинается с # и пробела (заголовок), и предыдущая строка не пустая -> вставляем пустую.
-        if re.match(r'^\s*#{1,6}\s', line) and i > 0 and lines[i-1].strip():
+        if _HEADER_RE.match(line) and i > 0 and stripped[i-1]:
              fixed_lines.append("")
              
         fixed_lines.append(line)
@@ -168,10 +189,7 @@ def convert_markdown_to_docx(markdown_text: str) -> bytes:
 
     # 1. Конвертируем Markdown в HTML
     # Используем расширения для поддержки таблиц и других элементов
-    html_text = markdown.markdown(
-        markdown_text, 
-        extensions=['tables', 'extra', 'fenced_code', 'nl2br']
-    )
+    html_text = _get_markdown().reset().convert(markdown_text)
     
     # 2. Создаем документ и парсер
     doc = Document()
@@ -199,6 +217,5 @@ def convert_markdown_to_docx(markdown_text: str) -> bytes:
     # 6. Сохраняем в байты
     file_stream = io.BytesIO()
     doc.save(file_stream)
-    file_stream.seek(0)
     
-    return file_stream.read()
+    return file_stream.getvalue()
@@ -0,0 +1,98 @@
+"""
+Разбор XML внутри DOCX для скриптов проверки (verify_*/reproduce_*).
+Читает части архива напрямую через lxml, без объектной модели python-docx.
+"""
+
+import io
+import zipfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from lxml import etree
+
+NS = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
+W = f"{{{NS['w']}}}"
+
+P_TAG = f'{W}p'
+TBL_TAG = f'{W}tbl'
+
+# XPath компилируются один раз и переиспользуются для всех элементов
+BODY_CHILDREN_XP = etree.XPath('/w:document/w:body/*', namespaces=NS)
+NUMID_XP = etree.XPath('./w:pPr/w:numPr/w:numId/@w:val', namespaces=NS)
+STYLE_XP = etree.XPath('./w:pPr/w:pStyle/@w:val', namespaces=NS)
+TEXT_XP = etree.XPath('.//w:t/text()', namespaces=NS)
+STYLE_NAMES_XP = etree.XPath('/w:styles/w:style[w:name]', namespaces=NS)
+PARAGRAPHS_XP = etree.XPath('//w:p', namespaces=NS)
+USED_NUMIDS_XP = etree.XPath('//w:numId/@w:val', namespaces=NS)
+NUM_DEFS_XP = etree.XPath('/w:numbering/w:num', namespaces=NS)
+START_OVERRIDE_XP = etree.XPath("./w:lvlOverride[@w:ilvl='0']/w:startOverride/@w:val", namespaces=NS)
+MARKER_PARAGRAPHS_XP = etree.XPath('//w:p[.//w:t[contains(text(), $marker)]]', namespaces=NS)
+NUMBERED_MARKER_PARAGRAPHS_XP = etree.XPath(
+    '//w:p[.//w:t[contains(text(), $marker)]][.//w:numPr]', namespaces=NS
+)
+
+
+def parse_part(docx: Union[str, bytes], part: str = 'word/document.xml') -> etree._ElementTree:
+    """Разбирает часть DOCX (путь к файлу или байты), читая её из архива потоком"""
+    source = io.BytesIO(docx) if isinstance(docx, bytes) else docx
+    with zipfile.ZipFile(source) as z, z.open(part) as f:
+        return etree.parse(f)
+
+
+def paragraph_text(p) -> str:
+    """Текст абзаца: все w:t подряд (как Paragraph.text, без табуляций и переносов)"""
+    return "".join(TEXT_XP(p))
+
+
+@dataclass
+class InspectionResult:
+    """Сводка по нумерации в DOCX"""
+    document: etree._ElementTree
+    # numId -> есть ли перезапуск нумерации с 1 (None, если numbering.xml нет)
+    num_defs: Optional[Dict[str, bool]]
+    # numId, на которые ссылаются абзацы документа, по порядку
+    num_ids: List[str]
+    
+    def paragraphs(self) -> List[Tuple[str, Optional[str]]]:
+        """Абзацы документа: (текст, numId или None)"""
+        result = []
+        for p in PARAGRAPHS_XP(self.document):
+            num_ids = NUMID_XP(p)
+            result.append((paragraph_text(p), num_ids[0] if num_ids else None))
+        return result
+    
+    def find_paragraphs(self, marker: str, numbered: bool = False) -> list:
+        """Абзацы, в тексте которых есть marker (только нумерованные, если numbered)"""
+        xpath = NUMBERED_MARKER_PARAGRAPHS_XP if numbered else MARKER_PARAGRAPHS_XP
+        return xpath(self.document, marker=marker)
+
+
+def inspect(docx: Union[str, bytes]) -> InspectionResult:
+    """Разбирает document.xml и numbering.xml из одного открытого архива"""
+    source = io.BytesIO(docx) if isinstance(docx, bytes) else docx
+    with zipfile.ZipFile(source) as z:
+        with z.open('word/document.xml') as f:
+            document = etree.parse(f)
+        try:
+            with z.open('word/numbering.xml') as f:
+                numbering = etree.parse(f)
+        except KeyError:
+            numbering = None
+    
+    num_defs = None
+    if numbering is not None:
+        num_defs = {
+            num.get(f'{W}numId'): START_OVERRIDE_XP(num) == ["1"]
+            for num in NUM_DEFS_XP(numbering)
+        }
+    
+    return InspectionResult(document=document, num_defs=num_defs, num_ids=USED_NUMIDS_XP(document))
+
+
+def style_names(docx: Union[str, bytes]) -> Dict[str, str]:
+    """Соответствие styleId -> отображаемое имя стиля"""
+    styles = parse_part(docx, 'word/styles.xml')
+    return {
+        style.get(f'{W}styleId'): style.find(f'{W}name').get(f'{W}val')
+        for style in STYLE_NAMES_XP(styles)
+    }
@@ -4,16 +4,34 @@
 
 import logging
 import asyncio
+import os
+import json
+import html
+import re
+import binascii
+import time
+import functools
+import hashlib
+import itertools
+from collections import OrderedDict
 from typing import Optional
 
-from aiogram import Router, Bot, F
+# orjson заметно быстрее разбирает JSON из ответов модели; без него - стандартный json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+import aiohttp
+from aiogram import Router, Bot, F, BaseMiddleware
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
-from aiogram.filters import Command
+from aiogram.filters import Command, BaseFilter
+from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.utils.chat_action import ChatActionSender
 import uuid
-from io import BytesIO
-from docx import Document
 
 from config import (
     SYSTEM_PROMPT, 
@@ -22,7 +40,8 @@ from config import (
     AVAILABLE_MODELS
 )
 from aiogram.types import ReactionTypeEmoji
-from openai_client import get_chat_response, encode_image_to_base64, generate_image, edit_image_with_dalle, transcribe_audio
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError
+from openai_client import get_chat_response, get_chat_responses_batch, encode_image_to_base64, generate_image, edit_image_with_dalle, transcribe_audio, VISION_DEFAULT_PROMPT
 from document_parser import extract_text_from_file, edit_docx_with_replacements, get_docx_structure_for_ai
 from docx_generator import convert_markdown_to_docx
 from conversations import conversation_manager
@@ -39,84 +58,145 @@ from keyboards import (
     get_convert_docx_keyboard
 )
 
+class _TTLCache:
+    """LRU-кэш с ограничением размера и временем жизни записей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+
 # Глобальный кэш для хранения длинных ответов
 # Key: UUID string, Value: text content
-RESPONSE_CACHE = {}
+# Ограничен по размеру и по времени, чтобы не копить ответы в памяти бесконечно
+RESPONSE_CACHE = _TTLCache(maxsize=256, ttl=3600)
+
+# Таймаут скачивания готовых изображений
+_DL_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+# Общая HTTP-сессия для скачивания изображений: соединения переиспользуются
+# между запросами. Создаётся при первом обращении внутри event loop.
+_http_session: aiohttp.ClientSession = None
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            timeout=_DL_TIMEOUT,
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300),
+            raise_for_status=True
+        )
+    return _http_session
+
+
+# Предел размера скачиваемого изображения (лимит Telegram на фото - 10 МБ, с запасом)
+_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+
+async def _download_image(url: str) -> bytes:
+    """Скачивает изображение по частям, не допуская файлов больше _MAX_IMAGE_BYTES"""
+    async with _get_http_session().get(url) as resp:
+        if resp.content_length is not None and resp.content_length > _MAX_IMAGE_BYTES:
+            raise ValueError(f"изображение слишком большое ({resp.content_length} байт)")
+        buf = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            buf += chunk
+            if len(buf) > _MAX_IMAGE_BYTES:
+                raise ValueError("изображение слишком большое")
+        return bytes(buf)
+
+
+async def close_http_session() -> None:
+    """Закрывает общую HTTP-сессию (при остановке бота)"""
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+# Подписи к отредактированным изображениям (%.200s обрезает запрос до 200 символов)
+_PHOTO_EDIT_CAPTION_TPL = "✅ Готово! Отредактировано по запросу:\n%.200s"
+_EDIT_CAPTION_TPL = "✅ Готово: %.200s\n\n💡 Можешь продолжить редактировать или отправить новое фото."
+_DALLE_EDIT_CAPTION_TPL = "✅ %.200s\n\n💡 Продолжай редактировать или напиши новый промпт для новой картинки"
+_DALLE_CAPTION_TPL = "🖼 %.150s"
+_DALLE_PROMPT_TPL = "\n\n📝 Промпт DALL-E: %.150s"
+_IMAGE_ERROR_TPL = "❌ Ошибка: %.100s"
+_DOC_DOWNLOAD_ERROR_TPL = "❌ Ошибка загрузки файла: %.100s"
+_VOICE_DOWNLOAD_ERROR_TPL = "❌ Ошибка загрузки голосового: %.100s"
+_TEMPLATE_EDIT_ERROR_TPL = "❌ Ошибка при редактировании: %.100s"
+_TEMPLATE_EDITED_CAPTION_TPL = ("✅ <b>Документ отредактирован!</b>\n\n"
+                                "📝 <b>Замены:</b>\n%s\n\n"
+                                "💡 Можешь загрузить новый шаблон или продолжить редактировать текущий.")
+
+# Количество попыток отправки готового изображения
+_PHOTO_SEND_ATTEMPTS = 3
+
+# Запросы "повтори", после которых картинка не меняется - отдаём последний результат без API
+_NOOP_EDITS = frozenset({"ещё раз", "еще раз", "again", "same", "то же", "то же самое", "the same"})
+_NOOP_EDIT_CAPTION = "♻️ Повторяю последний результат"
 
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 
-class AnimatedLoader:
-    """Анимированный лоадер с редактированием сообщения"""
-    
-    def __init__(self, message: Message, base_text: str = "Ищу ответ на Ваш вопрос"):
-        self.message = message
-        self.base_text = base_text
-        self.status_msg = None
-        self.running = False
-        self.task = None
-    
-    async def start(self) -> Message:
-        """Запускает анимацию"""
-        self.status_msg = await self.message.reply(f"{self.base_text}...")
-        self.running = True
-        self.task = asyncio.create_task(self._animate())
-        return self.status_msg
-    
-    async def _animate(self):
-        """Анимация точек"""
-        dots = [".", "..", "..."]
-        i = 0
-        while self.running:
-            try:
-                await asyncio.sleep(0.8)
-                if not self.running:
-                    break
-                i = (i + 1) % len(dots)
-                await self.status_msg.edit_text(f"{self.base_text}{dots[i]}")
-            except Exception:
-                break
+class ErrorMiddleware(BaseMiddleware):
+    """Перехватывает необработанные ошибки хендлеров сообщений и сообщает о них пользователю"""
     
-    async def stop_with_result(self, result_text: str = None):
-        """Останавливает анимацию и заменяет на результат"""
-        self.running = False
-        if self.task:
-            self.task.cancel()
-            try:
-                await self.task
-            except asyncio.CancelledError:
-                pass
-        return self.status_msg
-    
-    async def stop(self):
-        """Просто останавливает анимацию"""
-        self.running = False
-        if self.task:
-            self.task.cancel()
-
-
-# Состояния FSM
-def safe_handler(func):
-    """Декоратор для безопасного выполнения хендлеров"""
-    async def wrapper(message: Message, bot: Bot, *args, **kwargs):
+    async def __call__(self, handler, event, data):
         try:
-            return await func(message, bot, *args, **kwargs)
+            return await handler(event, data)
         except Exception as e:
-            logger.error(f"Unhandled error in {func.__name__}: {e}")
+            logger.error(f"Unhandled error in {data['handler'].callback.__name__}: {e}")
             try:
-                await message.reply(f"❌ Критическая ошибка: {e}")
+                await event.reply(f"❌ Критическая ошибка: {e}")
             except Exception:
                 pass
-    return wrapper
 
 
+router.message.middleware(ErrorMiddleware())
+
+
+# Состояния FSM
 class BotStates(StatesGroup):
     waiting_for_rename = State()
     waiting_for_custom_prompt = State()
 
 
+class IsEditMode(BaseFilter):
+    """Фильтр: у пользователя включён режим редактирования изображений"""
+    
+    async def __call__(self, message: Message) -> bool:
+        return conversation_manager.is_edit_mode(message.from_user.id)
+
+
+class IsDalleMode(BaseFilter):
+    """Фильтр: у пользователя включён DALL-E режим"""
+    
+    async def __call__(self, message: Message) -> bool:
+        return conversation_manager.is_dalle_mode(message.from_user.id)
+
+
 async def add_heart_reaction(message: Message, bot: Bot) -> None:
     """Добавляет реакцию ❤️ на сообщение пользователя"""
     try:
@@ -130,43 +210,84 @@ async def add_heart_reaction(message: Message, bot: Bot) -> None:
         logger.debug(f"Could not add reaction: {e}")
 
 
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_BG: set[asyncio.Task] = set()
+
+
+def _run_in_background(coro) -> None:
+    """Запускает некритичный вызов (реакции и т.п.) без ожидания результата"""
+    task = asyncio.create_task(coro)
+    _BG.add(task)
+    task.add_done_callback(_BG.discard)
+
+
+async def _reply_with_image(message: Message, photo: BufferedInputFile, caption: str) -> None:
+    """
+    Отправляет изображение ответом на сообщение.
+    При флуд-контроле (429) и сетевых ошибках Telegram повторяет отправку,
+    чтобы не терять уже готовый результат генерации.
+    """
+    for attempt in range(1, _PHOTO_SEND_ATTEMPTS + 1):
+        try:
+            await message.reply_photo(photo=photo, caption=caption)
+            return
+        except TelegramRetryAfter as e:
+            if attempt == _PHOTO_SEND_ATTEMPTS:
+                raise
+            logger.warning(f"reply_photo flood control, retry in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+        except TelegramNetworkError as e:
+            if attempt == _PHOTO_SEND_ATTEMPTS:
+                raise
+            logger.warning(f"reply_photo network error (attempt {attempt}): {e}")
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+
 def get_updated_keyboard(user_id: int) -> None:
     """Возвращает клавиатуру с учётом текущих режимов пользователя"""
     is_dalle = conversation_manager.is_dalle_mode(user_id)
     is_edit = conversation_manager.is_edit_mode(user_id)
     is_template = conversation_manager.is_template_mode(user_id)
-    return get_main_menu_keyboard(is_dalle_mode=is_dalle, is_edit_mode=is_edit, is_template_mode=is_template)
+    return get_main_menu_keyboard(is_dalle, is_edit, is_template)
 
 
-@router.message(Command("start"))
-async def cmd_start(message: Message) -> None:
-    """Обработчик команды /start"""
-    user_id = message.from_user.id
-    
-    # Создаём первую беседу, если её нет
-    if not conversation_manager.get_conversations(user_id):
-        conversation_manager.create_conversation(user_id, "Новая беседа")
-    
-    current_model = conversation_manager.get_user_model(user_id)
-    model_name = AVAILABLE_MODELS.get(current_model, current_model)
-    
-    welcome_text = f"""👋 **Привет!**
+def _user_model_name(user_id: int) -> str:
+    """Отображаемое название выбранной пользователем модели"""
+    model = conversation_manager.get_user_model(user_id)
+    return AVAILABLE_MODELS.get(model, model)
+
+
+# Статичные части приветствия (меняется только название модели)
+_WELCOME_PREFIX = """👋 <b>Привет!</b>
 
 Я — AI-ассистент на базе OpenAI GPT.
 
-**Что я умею:**
+<b>Что я умею:</b>
 • 💬 Вести несколько бесед параллельно
 • 🖼 Анализировать изображения
 • 📄 Читать PDF и DOCX документы
 • 🤖 Переключаться между моделями
 • ✨ Кастомные промпты (до 2 шт.)
 
-**Текущая модель:** {model_name}
+<b>Текущая модель:</b> """
+_WELCOME_SUFFIX = """
 
 Используй меню ниже для управления.
 Просто напиши сообщение, чтобы начать! 🚀"""
+
+
+@router.message(Command("start"))
+async def cmd_start(message: Message) -> None:
+    """Обработчик команды /start"""
+    user_id = message.from_user.id
     
-    await message.answer(welcome_text, reply_markup=get_updated_keyboard(user_id), parse_mode="Markdown")
+    # Создаём первую беседу, если её нет
+    if not conversation_manager.get_conversations(user_id):
+        conversation_manager.create_conversation(user_id, "Новая беседа")
+    
+    model_name = _user_model_name(user_id)
+    
+    await message.answer(f"{_WELCOME_PREFIX}{html.escape(model_name)}{_WELCOME_SUFFIX}", reply_markup=get_updated_keyboard(user_id), parse_mode=ParseMode.HTML)
 
 
 @router.message(Command("help"))
@@ -184,9 +305,9 @@ async def btn_new_conversation(message: Message) -> None:
     conv = conversation_manager.create_conversation(user_id)
     
     await message.answer(
-        f"✅ Создана новая беседа: **{conv.title}**\n\n"
+        f"✅ Создана новая беседа: <b>{html.escape(conv.title)}</b>\n\n"
         "Напиши мне что-нибудь!",
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
 
 
@@ -202,13 +323,13 @@ async def btn_my_conversations(message: Message) -> None:
     if not conversations:
         text = "У тебя пока нет бесед. Создай первую!"
     else:
-        text = f"📂 **Твои беседы** ({len(conversations)}):\n\n"
+        text = f"📂 <b>Твои беседы</b> ({len(conversations)}):\n\n"
         text += "Выбери беседу или создай новую:"
     
     await message.answer(
         text,
         reply_markup=get_conversations_keyboard(conversations, active_id),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
 
 
@@ -219,10 +340,10 @@ async def btn_select_model(message: Message) -> None:
     current_model = conversation_manager.get_user_model(user_id)
     
     await message.answer(
-        "🤖 **Выбери модель:**\n\n"
+        "🤖 <b>Выбери модель:</b>\n\n"
         "Разные модели имеют разные возможности и скорость.",
         reply_markup=get_models_keyboard(current_model),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
 
 
@@ -237,23 +358,23 @@ async def btn_editor_mode(message: Message) -> None:
         # Выключаем режим
         conversation_manager.set_edit_mode(user_id, False)
         await message.answer(
-            "🎨 **Режим редактирования выключен**\n\n"
+            "🎨 <b>Режим редактирования выключен</b>\n\n"
             "Теперь бот работает в обычном режиме.",
-            parse_mode="Markdown",
+            parse_mode=ParseMode.HTML,
             reply_markup=get_updated_keyboard(user_id)
         )
     else:
         # Включаем режим
         conversation_manager.set_edit_mode(user_id, True)
         await message.answer(
-            "🎨 **Режим редактирования включён!**\n\n"
-            "📸 **Как использовать:**\n"
+            "🎨 <b>Режим редактирования включён!</b>\n\n"
+            "📸 <b>Как использовать:</b>\n"
             "1. Отправь фото, которое хочешь редактировать\n"
             "2. Напиши что изменить (например: \"добавь шляпу\")\n"
             "3. Бот запомнит картинку и можно продолжать редактировать\n\n"
             "💡 Картинка сохраняется до выхода из режима.\n"
             "Нажми ❌ Выйти из редактора чтобы выйти.",
-            parse_mode="Markdown",
+            parse_mode=ParseMode.HTML,
             reply_markup=get_updated_keyboard(user_id)
         )
 
@@ -269,24 +390,24 @@ async def btn_dalle_mode(message: Message) -> None:
         # Выключаем режим
         conversation_manager.set_dalle_mode(user_id, False)
         await message.answer(
-            "🖼 **DALL-E режим выключен**\n\n"
+            "🖼 <b>DALL-E режим выключен</b>\n\n"
             "Теперь бот работает в обычном режиме.",
-            parse_mode="Markdown",
+            parse_mode=ParseMode.HTML,
             reply_markup=get_updated_keyboard(user_id)
         )
     else:
         # Включаем режим
         conversation_manager.set_dalle_mode(user_id, True)
         await message.answer(
-            "🖼 **DALL-E режим включён!**\n\n"
-            "🎨 **Как использовать:**\n"
+            "🖼 <b>DALL-E режим включён!</b>\n\n"
+            "🎨 <b>Как использовать:</b>\n"
             "• Просто напиши что нарисовать\n"
             "• Бот запомнит последнюю картинку\n"
             "• Можешь дописать: \"добавь солнце\" - и он отредактирует\n\n"
             "💡 Первое сообщение = новая картинка\n"
             "Следующие = редактирование\n\n"
             "Нажми ❌ Выйти из DALL-E чтобы выйти.",
-            parse_mode="Markdown",
+            parse_mode=ParseMode.HTML,
             reply_markup=get_updated_keyboard(user_id)
         )
 
@@ -302,26 +423,26 @@ async def btn_template_mode(message: Message) -> None:
         # Выключаем режим
         conversation_manager.set_template_mode(user_id, False)
         await message.answer(
-            "📄 **Режим шаблонов выключен**\n\n"
+            "📄 <b>Режим шаблонов выключен</b>\n\n"
             "Загруженный шаблон удалён. Теперь бот работает в обычном режиме.",
-            parse_mode="Markdown",
+            parse_mode=ParseMode.HTML,
             reply_markup=get_updated_keyboard(user_id)
         )
     else:
         # Включаем режим
         conversation_manager.set_template_mode(user_id, True)
         await message.answer(
-            "📄 **Режим шаблонов включён!**\n\n"
-            "📋 **Как использовать:**\n"
+            "📄 <b>Режим шаблонов включён!</b>\n\n"
+            "📋 <b>Как использовать:</b>\n"
             "1. Отправь DOCX документ (шаблон или договор)\n"
             "2. Опиши какие изменения нужно сделать:\n"
-            "   • _\"Замени ООО Ромашка на ООО Василёк\"_\n"
-            "   • _\"Измени дату на 15.03.2026\"_\n"
-            "   • _\"Поменяй сумму 100000 на 250000\"_\n"
+            "   • <i>\"Замени ООО Ромашка на ООО Василёк\"</i>\n"
+            "   • <i>\"Измени дату на 15.03.2026\"</i>\n"
+            "   • <i>\"Поменяй сумму 100000 на 250000\"</i>\n"
             "3. Бот создаст новый документ с сохранением форматирования!\n\n"
             "💡 Шрифты, стили и оформление сохранятся.\n"
             "Нажми ❌ Выйти из шаблона чтобы выйти.",
-            parse_mode="Markdown",
+            parse_mode=ParseMode.HTML,
             reply_markup=get_updated_keyboard(user_id)
         )
 
@@ -337,10 +458,10 @@ async def btn_clear_current(message: Message) -> None:
         return
     
     await message.answer(
-        f"🧹 Очистить историю беседы **{conv.title}**?\n\n"
+        f"🧹 Очистить историю беседы <b>{html.escape(conv.title)}</b>?\n\n"
         "Все сообщения будут удалены.",
         reply_markup=get_confirm_clear_keyboard(conv.id),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
 
 
@@ -350,39 +471,41 @@ async def btn_help(message: Message) -> None:
     await show_help(message)
 
 
-async def show_help(message: Message) -> None:
-    """Выводит справку"""
-    user_id = message.from_user.id
-    current_model = conversation_manager.get_user_model(user_id)
-    model_name = AVAILABLE_MODELS.get(current_model, current_model)
-    
-    help_text = f"""📖 **Справка**
+# Статичные части справки
+_HELP_PREFIX = """📖 <b>Справка</b>
 
-**Команды:**
-• `/start` — начать работу
-• `/help` — показать справку
+<b>Команды:</b>
+• <code>/start</code> — начать работу
+• <code>/help</code> — показать справку
 
-**Меню:**
-• 📝 **Новая беседа** — создать новую беседу
-• 📂 **Мои беседы** — список всех бесед
-• 🤖 **Модель** — сменить модель AI
-• 🗑 **Очистить** — очистить историю
-• ℹ️ **Помощь** — эта справка
+<b>Меню:</b>
+• 📝 <b>Новая беседа</b> — создать новую беседу
+• 📂 <b>Мои беседы</b> — список всех бесед
+• 🤖 <b>Модель</b> — сменить модель AI
+• 🗑 <b>Очистить</b> — очистить историю
+• ℹ️ <b>Помощь</b> — эта справка
 
-**Доступные модели:**
+<b>Доступные модели:</b>
 • ⚡ GPT-5 Nano — быстрая
 • 🔹 GPT-5 Mini — баланс
 • 🔷 GPT-5.2 — умная
 • 💎 GPT-5.2 Pro — максимум
 
-**Текущая модель:** {model_name}
+<b>Текущая модель:</b> """
+_HELP_SUFFIX = """
 
-**Возможности:**
+<b>Возможности:</b>
 • Веду несколько бесед с отдельной историей
 • Анализирую фото (отправь картинку)
 • Читаю PDF и DOCX файлы"""
+
+
+async def show_help(message: Message) -> None:
+    """Выводит справку"""
+    user_id = message.from_user.id
+    model_name = _user_model_name(user_id)
     
-    await message.answer(help_text, parse_mode="Markdown")
+    await message.answer(f"{_HELP_PREFIX}{html.escape(model_name)}{_HELP_SUFFIX}", parse_mode=ParseMode.HTML)
 
 
 @router.message(F.text == "✨ Промпты")
@@ -393,7 +516,7 @@ async def btn_custom_prompts(message: Message) -> None:
     prompts = conversation_manager.get_custom_prompts(user_id)
     active = conversation_manager.get_active_custom_prompt(user_id)
     
-    text = """✨ **Кастомные промпты**
+    text = """✨ <b>Кастомные промпты</b>
 
 Здесь ты можешь добавить до 2 своих системных промптов.
 Кастомный промпт будет добавлен к стандартному.
@@ -401,12 +524,12 @@ async def btn_custom_prompts(message: Message) -> None:
 """
     if prompts:
         text += f"У тебя {len(prompts)} промпт(ов):\n\n"
-        for i, p in enumerate(prompts):
-            is_active = p == active
-            status = "✅ активен" if is_active else ""
-            text += f"**{i+1}.** {p[:50]}{'...' if len(p) > 50 else ''} {status}\n\n"
+        text += "".join(
+            f"<b>{i+1}.</b> {html.escape(p[:50])}{'...' if len(p) > 50 else ''} {'✅ активен' if p == active else ''}\n\n"
+            for i, p in enumerate(prompts)
+        )
     else:
-        text += "_Ещё нет сохранённых промптов._\n\n"
+        text += "<i>Ещё нет сохранённых промптов.</i>\n\n"
     
     if active:
         text += "🟢 Сейчас используется кастомный промпт."
@@ -416,7 +539,7 @@ async def btn_custom_prompts(message: Message) -> None:
     await message.answer(
         text,
         reply_markup=get_custom_prompts_keyboard(prompts, active),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
 
 
@@ -429,9 +552,9 @@ async def callback_new_conversation(callback: CallbackQuery) -> None:
     conv = conversation_manager.create_conversation(user_id)
     
     await callback.message.edit_text(
-        f"✅ Создана новая беседа: **{conv.title}**\n\n"
+        f"✅ Создана новая беседа: <b>{html.escape(conv.title)}</b>\n\n"
         "Напиши мне что-нибудь!",
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
     await callback.answer()
 
@@ -445,13 +568,13 @@ async def callback_list_conversations(callback: CallbackQuery) -> None:
     active = conversation_manager.get_active_conversation(user_id)
     active_id = active.id if active else None
     
-    text = f"📂 **Твои беседы** ({len(conversations)}):\n\n"
+    text = f"📂 <b>Твои беседы</b> ({len(conversations)}):\n\n"
     text += "Выбери беседу или создай новую:"
     
     await callback.message.edit_text(
         text,
         reply_markup=get_conversations_keyboard(conversations, active_id),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
     await callback.answer()
 
@@ -460,17 +583,17 @@ async def callback_list_conversations(callback: CallbackQuery) -> None:
 async def callback_select_conversation(callback: CallbackQuery) -> None:
     """Выбор беседы"""
     user_id = callback.from_user.id
-    conv_id = callback.data.split(":")[1]
+    conv_id = callback.data[callback.data.index(":") + 1:]
     
     conv = conversation_manager.set_active_conversation(user_id, conv_id)
     
     if conv:
         await callback.message.edit_text(
-            f"📝 **{conv.title}**\n\n"
+            f"📝 <b>{html.escape(conv.title)}</b>\n\n"
             f"Сообщений в истории: {len(conv.messages)}\n\n"
             "Что хочешь сделать?",
             reply_markup=get_conversation_actions_keyboard(conv_id),
-            parse_mode="Markdown"
+            parse_mode=ParseMode.HTML
         )
     else:
         await callback.answer("❌ Беседа не найдена", show_alert=True)
@@ -482,16 +605,16 @@ async def callback_select_conversation(callback: CallbackQuery) -> None:
 async def callback_select_model(callback: CallbackQuery) -> None:
     """Выбор модели"""
     user_id = callback.from_user.id
-    model_id = callback.data.split(":")[1]
+    model_id = callback.data[callback.data.index(":") + 1:]
     
     if model_id in AVAILABLE_MODELS:
         conversation_manager.set_user_model(user_id, model_id)
         model_name = AVAILABLE_MODELS[model_id]
         
         await callback.message.edit_text(
-            f"✅ Модель изменена на: **{model_name}**\n\n"
+            f"✅ Модель изменена на: <b>{html.escape(model_name)}</b>\n\n"
             "Новые сообщения будут обрабатываться этой моделью.",
-            parse_mode="Markdown"
+            parse_mode=ParseMode.HTML
         )
         await callback.answer(f"Выбрана модель: {model_id}")
     else:
@@ -501,7 +624,7 @@ async def callback_select_model(callback: CallbackQuery) -> None:
 @router.callback_query(F.data.startswith("rename_conv:"))
 async def callback_rename_conversation(callback: CallbackQuery, state: FSMContext) -> None:
     """Начать переименование беседы"""
-    conv_id = callback.data.split(":")[1]
+    conv_id = callback.data[callback.data.index(":") + 1:]
     
     await state.set_state(BotStates.waiting_for_rename)
     await state.update_data(conv_id=conv_id)
@@ -540,7 +663,7 @@ async def process_rename(message: Message, state: FSMContext) -> None:
     new_title = message.text.strip()[:50]  # Ограничиваем длину
     
     if conversation_manager.rename_conversation(user_id, conv_id, new_title):
-        await message.answer(f"✅ Беседа переименована в: **{new_title}**", parse_mode="Markdown")
+        await message.answer(f"✅ Беседа переименована в: <b>{html.escape(new_title)}</b>", parse_mode=ParseMode.HTML)
     else:
         await message.answer("❌ Не удалось переименовать беседу.")
     
@@ -550,7 +673,7 @@ async def process_rename(message: Message, state: FSMContext) -> None:
 @router.callback_query(F.data.startswith("clear_conv:"))
 async def callback_clear_conversation(callback: CallbackQuery) -> None:
     """Запрос на очистку беседы"""
-    conv_id = callback.data.split(":")[1]
+    conv_id = callback.data[callback.data.index(":") + 1:]
     
     await callback.message.edit_text(
         "🧹 Очистить всю историю этой беседы?\n\n"
@@ -564,7 +687,7 @@ async def callback_clear_conversation(callback: CallbackQuery) -> None:
 async def callback_confirm_clear(callback: CallbackQuery) -> None:
     """Подтверждение очистки беседы"""
     user_id = callback.from_user.id
-    conv_id = callback.data.split(":")[1]
+    conv_id = callback.data[callback.data.index(":") + 1:]
     
     if conversation_manager.clear_conversation(user_id, conv_id):
         await callback.message.edit_text("✅ История беседы очищена!")
@@ -577,7 +700,7 @@ async def callback_confirm_clear(callback: CallbackQuery) -> None:
 @router.callback_query(F.data.startswith("delete_conv:"))
 async def callback_delete_conversation(callback: CallbackQuery) -> None:
     """Запрос на удаление беседы"""
-    conv_id = callback.data.split(":")[1]
+    conv_id = callback.data[callback.data.index(":") + 1:]
     
     await callback.message.edit_text(
         "🗑 Удалить эту беседу?\n\n"
@@ -591,7 +714,7 @@ async def callback_delete_conversation(callback: CallbackQuery) -> None:
 async def callback_confirm_delete(callback: CallbackQuery) -> None:
     """Подтверждение удаления беседы"""
     user_id = callback.from_user.id
-    conv_id = callback.data.split(":")[1]
+    conv_id = callback.data[callback.data.index(":") + 1:]
     
     if conversation_manager.delete_conversation(user_id, conv_id):
         # Создаём новую беседу если удалили последнюю
@@ -611,7 +734,7 @@ async def callback_confirm_delete(callback: CallbackQuery) -> None:
 async def callback_toggle_prompt(callback: CallbackQuery) -> None:
     """Включить/выключить кастомный промпт"""
     user_id = callback.from_user.id
-    index = int(callback.data.split(":")[1])
+    index = int(callback.data[callback.data.index(":") + 1:])
     
     prompts = conversation_manager.get_custom_prompts(user_id)
     active = conversation_manager.get_active_custom_prompt(user_id)
@@ -622,18 +745,21 @@ async def callback_toggle_prompt(callback: CallbackQuery) -> None:
         if selected_prompt == active:
             # Отключаем, если уже активен
             conversation_manager.set_active_custom_prompt(user_id, None)
-            await callback.answer("Кастомный промпт отключён")
+            answer_text = "Кастомный промпт отключён"
         else:
             # Включаем выбранный
             conversation_manager.set_active_custom_prompt(user_id, index)
-            await callback.answer(f"Промпт {index + 1} активирован!")
+            answer_text = f"Промпт {index + 1} активирован!"
         
         # Обновляем сообщение
         prompts = conversation_manager.get_custom_prompts(user_id)
         active = conversation_manager.get_active_custom_prompt(user_id)
         
-        await callback.message.edit_reply_markup(
-            reply_markup=get_custom_prompts_keyboard(prompts, active)
+        await asyncio.gather(
+            callback.answer(answer_text),
+            callback.message.edit_reply_markup(
+                reply_markup=get_custom_prompts_keyboard(prompts, active)
+            )
         )
     else:
         await callback.answer("❌ Промпт не найден", show_alert=True)
@@ -643,7 +769,7 @@ async def callback_toggle_prompt(callback: CallbackQuery) -> None:
 async def callback_delete_prompt(callback: CallbackQuery) -> None:
     """Удалить кастомный промпт"""
     user_id = callback.from_user.id
-    index = int(callback.data.split(":")[1])
+    index = int(callback.data[callback.data.index(":") + 1:])
     
     if conversation_manager.delete_custom_prompt(user_id, index):
         await callback.answer(f"Промпт {index + 1} удалён!")
@@ -652,7 +778,7 @@ async def callback_delete_prompt(callback: CallbackQuery) -> None:
         prompts = conversation_manager.get_custom_prompts(user_id)
         active = conversation_manager.get_active_custom_prompt(user_id)
         
-        text = """✨ **Кастомные промпты**
+        text = """✨ <b>Кастомные промпты</b>
 
 Здесь ты можешь добавить до 2 своих системных промптов.
 
@@ -660,12 +786,12 @@ async def callback_delete_prompt(callback: CallbackQuery) -> None:
         if prompts:
             text += f"У тебя {len(prompts)} промпт(ов).\n"
         else:
-            text += "_Все промпты удалены._\n"
+            text += "<i>Все промпты удалены.</i>\n"
         
         await callback.message.edit_text(
             text,
             reply_markup=get_custom_prompts_keyboard(prompts, active),
-            parse_mode="Markdown"
+            parse_mode=ParseMode.HTML
         )
     else:
         await callback.answer("❌ Не удалось удалить промпт", show_alert=True)
@@ -684,15 +810,15 @@ async def callback_add_custom_prompt(callback: CallbackQuery, state: FSMContext)
     await state.set_state(BotStates.waiting_for_custom_prompt)
     
     await callback.message.edit_text(
-        f"✏️ **Введи текст нового промпта:**\n\n"
+        f"✏️ <b>Введи текст нового промпта:</b>\n\n"
         "Этот текст будет добавлен к стандартному системному промпту.\n\n"
         "Например:\n"
-        "• _Отвечай кратко, не более 3 предложений_\n"
-        "• _Всегда предлагай примеры кода_\n"
-        "• _Говори как пират_ 🏴‍☠️"
+        "• <i>Отвечай кратко, не более 3 предложений</i>\n"
+        "• <i>Всегда предлагай примеры кода</i>\n"
+        "• <i>Говори как пират</i> 🏴‍☠️"
         f"{note}",
         reply_markup=get_cancel_keyboard(),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
     await callback.answer()
 
@@ -710,7 +836,7 @@ async def callback_disable_custom_prompt(callback: CallbackQuery) -> None:
         "✅ Теперь используется стандартный промпт.\n\n"
         "Твои сохранённые промпты по-прежнему доступны.",
         reply_markup=get_custom_prompts_keyboard(prompts, None),
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
     await callback.answer("Стандартный промпт активирован")
 
@@ -736,9 +862,9 @@ async def process_custom_prompt(message: Message, state: FSMContext) -> None:
     
     await message.answer(
         f"✅ Промпт #{index} добавлен и активирован!\n\n"
-        f"📝 _{prompt_text[:100]}{'...' if len(prompt_text) > 100 else ''}_\n\n"
+        f"📝 <i>{html.escape(prompt_text[:100])}{'...' if len(prompt_text) > 100 else ''}</i>\n\n"
         "Теперь бот будет использовать этот промпт.",
-        parse_mode="Markdown"
+        parse_mode=ParseMode.HTML
     )
     
     await state.clear()
@@ -752,23 +878,26 @@ async def process_custom_prompt(message: Message, state: FSMContext) -> None:
 async def callback_download_response(callback: CallbackQuery) -> None:
     """Обработка скачивания TXT версии"""
     try:
-        _, format_type, response_id = callback.data.split(":")
+        _, format_type, response_id = callback.data.split(":", 2)
         
-        if response_id not in RESPONSE_CACHE:
+        content = RESPONSE_CACHE.get(response_id)
+        if content is None:
             await callback.answer("❌ Файл устарел или не найден", show_alert=True)
             return
-            
-        content = RESPONSE_CACHE[response_id]
         
         if format_type == "txt":
             file_bytes = content.encode('utf-8')
             file = BufferedInputFile(file_bytes, filename="response.txt")
-            await callback.message.reply_document(
-                document=file,
-                caption="📄 Ваш ответ в формате TXT"
+            # Отправляем файл и убираем кнопки (скачивание одноразовое) параллельно.
+            # callback.answer() - после, чтобы при ошибке можно было ответить алертом
+            await asyncio.gather(
+                callback.message.reply_document(
+                    document=file,
+                    caption="📄 Ваш ответ в формате TXT"
+                ),
+                callback.message.edit_reply_markup(reply_markup=None)
             )
-            # Удаляем кнопки после нажатия
-            await callback.message.edit_reply_markup(reply_markup=None)
+            RESPONSE_CACHE.pop(response_id, None)
             await callback.answer()
             
     except Exception as e:
@@ -778,8 +907,79 @@ async def callback_download_response(callback: CallbackQuery) -> None:
 
 # ============== ОБРАБОТЧИКИ КОНТЕНТА ==============
 
-import re
-from aiogram.enums import ParseMode
+
+# Экранирование HTML одним проходом
+_HTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+# Все конструкции Markdown, которые понимает Telegram, в одной альтернативе.
+# Текст размечается за один проход, без плейсхолдеров и повторных замен.
+_MD_TOKEN_RE = re.compile(
+    r'```(?P<lang>\w*)\n?(?P<fence>.*?)```'          # блок кода ```language\ncode```
+    r'|`(?P<code>[^`]+)`'                            # инлайн код `code`
+    r'|\*\*(?P<bold>[^*]+)\*\*'                      # жирный **text**
+    r'|(?<![*\w])\*(?P<bold1>[^*\n]+)\*(?![*\w])'    # жирный *text*
+    r'|(?<![_\w])_(?P<ital>[^_\n]+)_(?![_\w])'       # курсив _text_
+    r'|~(?P<strike>[^~]+)~'                          # зачёркнутый ~text~
+    r'|\|\|(?P<spoiler>[^|]+)\|\|'                   # спойлер ||text||
+    r'|__(?P<uline>[^_]+)__',                        # подчёркнутый __text__
+    re.DOTALL
+)
+
+# Символы, с которых начинается любая конструкция _MD_TOKEN_RE.
+# Если их нет, разметки в тексте нет и конвертировать нечего.
+_MD_SIGILS_RE = re.compile(r'[`*_~|]')
+
+_MD_TAGS = {
+    "bold": "b",
+    "bold1": "b",
+    "ital": "i",
+    "strike": "s",
+    "spoiler": "tg-spoiler",
+    "uline": "u",
+}
+
+
+def _render_markdown(text: str, pos: int, endpos: int, out: list) -> None:
+    """Размечает text[pos:endpos], дописывая HTML-фрагменты в out"""
+    for match in _MD_TOKEN_RE.finditer(text, pos, endpos):
+        start = match.start()
+        if start > pos:
+            out.append(text[pos:start].translate(_HTML_ESCAPE))
+        pos = match.end()
+        
+        kind = match.lastgroup
+        if kind == "fence":
+            lang = match.group("lang")
+            code = match.group("fence").translate(_HTML_ESCAPE)
+            if lang:
+                out.append(f'<pre><code class="language-{lang}">{code}</code></pre>')
+            else:
+                out.append(f'<pre><code>{code}</code></pre>')
+        elif kind == "code":
+            out.append(f'<code>{match.group("code").translate(_HTML_ESCAPE)}</code>')
+        else:
+            # Внутри форматирования может быть другое форматирование
+            tag = _MD_TAGS[kind]
+            out.append(f"<{tag}>")
+            _render_markdown(text, match.start(kind), match.end(kind), out)
+            out.append(f"</{tag}>")
+    
+    if pos < endpos:
+        out.append(text[pos:endpos].translate(_HTML_ESCAPE))
+
+
+# Короткие тексты (служебные ответы, ошибки) часто повторяются - их результат кэшируем.
+# Длинные ответы модели уникальны и только вытесняли бы кэш.
+_MD_CACHE_MAX_LEN = 4096
+
+
+def _convert_markdown_to_html(text: str) -> str:
+    out = []
+    _render_markdown(text, 0, len(text), out)
+    return "".join(out)
+
+
+_convert_markdown_to_html_cached = functools.lru_cache(maxsize=512)(_convert_markdown_to_html)
 
 
 def convert_markdown_to_html(text: str) -> str:
@@ -787,67 +987,40 @@ def convert_markdown_to_html(text: str) -> str:
     Конвертирует Markdown в HTML для Telegram.
     Поддерживает: жирный, курсив, код, блоки кода.
     """
-    # Сначала обрабатываем блоки кода (чтобы не затронуть их содержимое)
-    code_blocks = []
-    
-    def save_code_block(match):
-        lang = match.group(1) or ""
-        code = match.group(2)
-        # Экранируем HTML в коде
-        code = code.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        if lang:
-            code_blocks.append(f'<pre><code class="language-{lang}">{code}</code></pre>')
-        else:
-            code_blocks.append(f'<pre><code>{code}</code></pre>')
-        return f"<<<CODE_BLOCK_{len(code_blocks) - 1}>>>"
-    
-    # Блоки кода ```language\ncode```
-    text = re.sub(r'```(\w*)\n?(.*?)```', save_code_block, text, flags=re.DOTALL)
-    
-    # Инлайн код `code`
-    inline_codes = []
-    def save_inline_code(match):
-        code = match.group(1)
-        code = code.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        inline_codes.append(f'<code>{code}</code>')
-        return f"<<<INLINE_CODE_{len(inline_codes) - 1}>>>"
-    
-    text = re.sub(r'`([^`]+)`', save_inline_code, text)
-    
-    # Экранируем HTML в остальном тексте
-    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-    
-    # Жирный текст **text** или *text*
-    text = re.sub(r'\*\*([^*]+)\*\*', r'<b>\1</b>', text)
-    text = re.sub(r'(?<![*\w])\*([^*\n]+)\*(?![*\w])', r'<b>\1</b>', text)
-    
-    # Курсив _text_
-    text = re.sub(r'(?<![_\w])_([^_\n]+)_(?![_\w])', r'<i>\1</i>', text)
-    
-    # Зачёркнутый ~text~
-    text = re.sub(r'~([^~]+)~', r'<s>\1</s>', text)
-    
-    # Спойлер ||text||
-    text = re.sub(r'\|\|([^|]+)\|\|', r'<tg-spoiler>\1</tg-spoiler>', text)
-    
-    # Подчёркнутый __text__
-    text = re.sub(r'__([^_]+)__', r'<u>\1</u>', text)
-    
-    # Восстанавливаем блоки кода
-    for i, block in enumerate(code_blocks):
-        text = text.replace(f"&lt;&lt;&lt;CODE_BLOCK_{i}&gt;&gt;&gt;", block)
+    if len(text) > _MD_CACHE_MAX_LEN:
+        return _convert_markdown_to_html(text)
+    return _convert_markdown_to_html_cached(text)
+
+
+# Сколько символов промежуточного ответа помещаем в статусное сообщение (лимит Telegram - 4096)
+_PARTIAL_PREVIEW_CHARS = 4000
+
+
+def _status_preview_updater(status_msg: Message):
+    """Возвращает on_partial для get_chat_response, показывающий текст в статусном сообщении"""
+    last_preview = None
     
-    for i, code in enumerate(inline_codes):
-        text = text.replace(f"&lt;&lt;&lt;INLINE_CODE_{i}&gt;&gt;&gt;", code)
+    async def update(text: str) -> None:
+        nonlocal last_preview
+        # Без разметки: незаконченный Markdown может не пройти разбор HTML
+        preview = _cap(text, _PARTIAL_PREVIEW_CHARS, " …")
+        if preview != last_preview:
+            last_preview = preview
+            await status_msg.edit_text(preview)
     
-    return text
+    return update
 
 
-async def get_smart_response(user_id: int, user_question: str, messages: list, status_msg: Message) -> str:
+async def get_smart_response(
+    user_id: int, user_question: str, messages: list, status_msg: Message, cache_key: Optional[str] = None
+) -> str:
     """
     Умное получение ответа с поддержкой больших контекстов (Map-Reduce).
     Если контекст слишком большой, разбивает обработку на этапы.
+    cache_key - ключ для кэша ответов, если messages отправляются как есть.
+    Итоговый ответ по мере генерации показывается в status_msg.
     """
+    on_partial = _status_preview_updater(status_msg)
     
     # 1. Считаем общий размер контекста
     total_chars = sum(len(m.get("content", "")) for m in messages)
@@ -862,7 +1035,7 @@ async def get_smart_response(user_id: int, user_question: str, messages: list, s
         # Обычный режим
         logger.info("Using standard direct request")
         model = conversation_manager.get_user_model(user_id)
-        return await get_chat_response(messages, model=model)
+        return await get_chat_response(messages, model=model, cache_key=cache_key, on_partial=on_partial)
     
     # === РЕЖИМ MAP-REDUCE ===
     logger.info("Triggering Map-Reduce mode for heavy context")
@@ -884,25 +1057,27 @@ async def get_smart_response(user_id: int, user_question: str, messages: list, s
         # Если вдруг набралось много мелочи, но нет явных документов - отправляем как есть
         logger.info("No single heavy messages found, falling back to standard")
         model = conversation_manager.get_user_model(user_id)
-        return await get_chat_response(messages, model=model)
+        return await get_chat_response(messages, model=model, cache_key=cache_key, on_partial=on_partial)
         
-    # 3. MAP: Анализируем каждый тяжелый документ
+    # 3. MAP: Анализируем тяжелые документы (параллельно, запросы независимы)
     summaries = []
     model = conversation_manager.get_user_model(user_id)
     
-    for i, doc_msg in enumerate(heavy_messages):
-        await status_msg.edit_text(f"🔍 Анализирую документ {i+1} из {len(heavy_messages)}...")
-        
+    await status_msg.edit_text(f"🔍 Анализирую документы ({len(heavy_messages)} шт.)...")
+    
+    map_prompts = []
+    for doc_msg in heavy_messages:
         doc_content = doc_msg.get("content", "")
         
         # Промпт для анализа конкретного куска
-        map_prompt = [
+        map_prompts.append([
             {"role": "system", "content": "Ты аналитик данных. Твоя задача — найти информацию, релевантную вопросу пользователя, в предоставленном тексте. Если информации нет, ответь 'Нет релевантной информации'."},
             {"role": "user", "content": f"Вопрос пользователя: {user_question}\n\nТекст для анализа:\n{doc_content[:40000]}"} # Обрезаем безопаснее (40к ~ 10к токенов)
-        ]
-        
-        chunk_response = await get_chat_response(map_prompt, model=model)
-        
+        ])
+    
+    map_responses = await get_chat_responses_batch(map_prompts, model=model)
+    
+    for i, chunk_response in enumerate(map_responses):
         logger.info(f"Map result {i+1}: {len(chunk_response)} chars")
         if "нет релевантной информации" not in chunk_response.lower() and len(chunk_response) > 10:
             summaries.append(f"=== Информация из документа {i+1} ===\n{chunk_response}")
@@ -933,40 +1108,142 @@ async def get_smart_response(user_id: int, user_question: str, messages: list, s
     
     # 5. Финальный запрос
     logger.info("Sending reduced context to OpenAI")
-    return await get_chat_response(final_messages, model=model)
+    return await get_chat_response(final_messages, model=model, on_partial=on_partial)
+
+
+# Разметка, которую убирает clean_markdown (блок кода, жирный, курсив, код, заголовки)
+_MD_CLEAN_RE = re.compile(
+    r'(?s:```\w*\n(?P<fence>.+?)```)'
+    r'|\*\*(?P<bold>.+?)\*\*'
+    r'|_(?P<ital>.+?)_'
+    r'|`(?P<code>.+?)`'
+    r'|^#+\s+(?P<header>.+)$',
+    re.MULTILINE
+)
+
+
+def _clean_markdown_match(match: re.Match) -> str:
+    kind = match.lastgroup
+    if kind == "fence":
+        # Содержимое блока кода оставляем как есть
+        return match.group(kind)
+    return _MD_CLEAN_RE.sub(_clean_markdown_match, match.group(kind))
+
+
+@functools.lru_cache(maxsize=512)
+def _clean_markdown_cached(text: str) -> str:
+    return _MD_CLEAN_RE.sub(_clean_markdown_match, text)
 
 
 def clean_markdown(text: str) -> str:
     """Удаляет символы markdown из текста"""
-    # Жирный
-    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
-    # Курсив
-    text = re.sub(r'_(.+?)_', r'\1', text)
-    # Код
-    text = re.sub(r'`(.+?)`', r'\1', text)
-    text = re.sub(r'```[\w]*\n(.+?)```', r'\1', text, flags=re.DOTALL)
-    # Заголовки
-    text = re.sub(r'^#+\s+(.+)$', r'\1', text, flags=re.MULTILINE)
-    # Списки
-    # text = re.sub(r'^\s*[\-\*]\s+', '', text, flags=re.MULTILINE) # Оставляем списки, они полезны
-    return text
+    # Списки оставляем, они полезны
+    if len(text) > _MD_CACHE_MAX_LEN:
+        return _MD_CLEAN_RE.sub(_clean_markdown_match, text)
+    return _clean_markdown_cached(text)
+
+
+# "Замени X на Y" / "измени «X» на «Y»" - простая замена без запроса к модели
+_SIMPLE_REPLACE_VERB = r'(?:замени(?:ть)?|измени(?:ть)?|поменя(?:й|ть))\s+'
+_SIMPLE_REPLACE_QUOTED_RE = re.compile(
+    _SIMPLE_REPLACE_VERB + r'["«]([^"«»]+)["»]\s+на\s+["«]([^"«»]+)["»][.!]?$',
+    re.IGNORECASE
+)
+_SIMPLE_REPLACE_PLAIN_RE = re.compile(
+    _SIMPLE_REPLACE_VERB + r'(\S.*?)\s+на\s+(\S.*?)[.!]?$',
+    re.IGNORECASE
+)
+# Признаки составного запроса ("замени X на Y, и ещё ...") - такие разбирает модель
+_SIMPLE_REPLACE_JOINERS_RE = re.compile(r'[,;]|\b(?:и|а)\b|\bна\b.*\bна\b', re.IGNORECASE | re.DOTALL)
+
+
+def _simple_replacement(user_text: str, doc_structure: str) -> Optional[dict]:
+    """
+    Разбирает запрос вида "замени X на Y" без модели.
+    Без кавычек запрос должен содержать ровно одно "на" и не содержать
+    запятых и союзов - иначе границы X и Y неоднозначны. X должен
+    встречаться в документе целым словом и быть либо в кавычках, либо
+    начинаться с заглавной буквы/цифры (названия, ФИО, даты, суммы) -
+    описания вроде "замени дату на ..." оставляем модели.
+    """
+    text = user_text.strip()
+    match = _SIMPLE_REPLACE_QUOTED_RE.match(text)
+    if match:
+        old, new = match.groups()
+    else:
+        match = _SIMPLE_REPLACE_PLAIN_RE.match(text)
+        if not match or _SIMPLE_REPLACE_JOINERS_RE.search(text):
+            return None
+        old, new = match.groups()
+        if not (old[0].isupper() or old[0].isdigit()):
+            return None
+    # Целым словом: "Иван" не должен совпадать с "Иванов"
+    if not re.search(rf'(?<!\w){re.escape(old)}(?!\w)', doc_structure):
+        return None
+    return {old: new}
+
+# Форматы документов, из которых умеем извлекать текст
+# Лимиты для документов: размер файла (ограничение Bot API на скачивание)
+# и объём текста, который попадает в контекст модели
+_MAX_DOC_BYTES = 20 * 1024 * 1024
+_MAX_DOC_CHARS = 100000
+
+_SUPPORTED_DOC_EXTS = frozenset({'.pdf', '.docx', '.txt'})
+
+
+def _cap(text: str, limit: int, suffix: str = "\n[...]") -> str:
+    """Обрезает текст до limit символов; короткий текст возвращается как есть"""
+    return text if len(text) <= limit else text[:limit] + suffix
+
+# Подписи к ответу, отправленному файлом
+_DOCX_FAILED_CAPTION = ("📄 <b>Не удалось отправить сообщение</b>\n"
+                        "Отправляю в формате DOCX (с сохранением форматирования).")
+_DOCX_TOO_LONG_CAPTION = ("📄 <b>Ответ слишком длинный</b>\n"
+                          "Отправляю в формате DOCX (с сохранением форматирования).")
+
+
+async def _send_as_document(reply_target: Message, response: str, caption: str, txt_caption: str) -> None:
+    """Отправляет ответ DOCX-файлом с кнопкой на TXT, если DOCX не получился — просто TXT"""
+    clean_text = clean_markdown(response)
+    response_id = uuid.uuid4().hex
+    RESPONSE_CACHE.set(response_id, clean_text)
+    
+    try:
+        # Создаем DOCX с форматированием
+        docx_bytes = convert_markdown_to_docx(response)
+        await reply_target.reply_document(
+            document=BufferedInputFile(docx_bytes, filename="response.docx"),
+            caption=caption,
+            reply_markup=get_txt_download_keyboard(response_id),
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        # Если DOCX не создался, шлем TXT
+        logger.error(f"DOCX gen error: {e}")
+        await reply_target.reply_document(
+            document=BufferedInputFile(clean_text.encode('utf-8'), filename="response.txt"),
+            caption=txt_caption
+        )
 
 
 async def send_response(message: Message, response: str, show_docx_button: bool = False) -> None:
     """Отправляет ответ с HTML форматированием, если слишком длинный — в файле"""
     if len(response) <= MAX_TELEGRAM_MESSAGE_LENGTH:
         try:
-            # Пробуем отправить с HTML форматированием
-            html_response = convert_markdown_to_html(response)
+            # Пробуем отправить с HTML форматированием (текст без разметки - как есть)
+            if _MD_SIGILS_RE.search(response):
+                text, parse_mode = convert_markdown_to_html(response), ParseMode.HTML
+            else:
+                text, parse_mode = response, None
             
             keyboard = None
             if show_docx_button:
                 # Сохраняем ответ в кэш для возможной конвертации
-                response_id = str(uuid.uuid4())
-                RESPONSE_CACHE[response_id] = response
+                response_id = uuid.uuid4().hex
+                RESPONSE_CACHE.set(response_id, response)
                 keyboard = get_convert_docx_keyboard(response_id)
             
-            await message.reply(html_response, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+            await message.reply(text, parse_mode=parse_mode, reply_markup=keyboard)
         except Exception as e:
             # Если форматирование сломалось, отправляем без него
             logger.warning(f"HTML parse error: {e}")
@@ -974,66 +1251,19 @@ async def send_response(message: Message, response: str, show_docx_button: bool
                 # Если форматирование не прошло, шлем просто текстом
                 keyboard = None
                 if show_docx_button:
-                    response_id = str(uuid.uuid4())
-                    RESPONSE_CACHE[response_id] = response
+                    response_id = uuid.uuid4().hex
+                    RESPONSE_CACHE.set(response_id, response)
                     keyboard = get_convert_docx_keyboard(response_id)
                     
                 await message.reply(response, reply_markup=keyboard)
             except Exception:
                 # Если и так не получилось, отправляем DOCX + кнопку на TXT
-                clean_text = clean_markdown(response)
-                response_id = str(uuid.uuid4())
-                RESPONSE_CACHE[response_id] = clean_text
-                
-                try:
-                    # Создаем DOCX с форматированием
-                    docx_bytes = convert_markdown_to_docx(response)
-                    file = BufferedInputFile(docx_bytes, filename="response.docx")
-                    
-                    await message.reply_document(
-                        document=file,
-                        caption="📄 **Не удалось отправить сообщение**\n"
-                                "Отправляю в формате DOCX (с сохранением форматирования).",
-                        reply_markup=get_txt_download_keyboard(response_id),
-                        parse_mode="Markdown"
-                    )
-                except Exception as ex:
-                    # Если DOCX не создался, шлем TXT
-                    logger.error(f"DOCX gen error: {ex}")
-                    file_bytes = clean_text.encode('utf-8')
-                    file = BufferedInputFile(file_bytes, filename="response.txt")
-                    await message.reply_document(
-                        document=file,
-                        caption="📄 Отправляю файлом."
-                    )
+                await _send_as_document(message, response, _DOCX_FAILED_CAPTION, "📄 Отправляю файлом.")
 
     else:
         # Ответ слишком длинный - отправляем DOCX + кнопку на TXT
-        clean_text = clean_markdown(response)
-        response_id = str(uuid.uuid4())
-        RESPONSE_CACHE[response_id] = clean_text
-        
-        try:
-            # Создаем DOCX с форматированием
-            docx_bytes = convert_markdown_to_docx(response)
-            file = BufferedInputFile(docx_bytes, filename="response.docx")
-            
-            await message.reply_document(
-                document=file,
-                caption="📄 **Ответ слишком длинный**\n"
-                        "Отправляю в формате DOCX (с сохранением форматирования).",
-                reply_markup=get_txt_download_keyboard(response_id),
-                parse_mode="Markdown"
-            )
-        except Exception as ex:
-             # Если DOCX не создался, шлем TXT
-            logger.error(f"DOCX gen error: {ex}")
-            file_bytes = clean_text.encode('utf-8')
-            file = BufferedInputFile(file_bytes, filename="response.txt")
-            await message.reply_document(
-                document=file,
-                caption="📄 Ответ слишком длинный, отправляю файлом."
-            )
+        await _send_as_document(message, response, _DOCX_TOO_LONG_CAPTION,
+                                "📄 Ответ слишком длинный, отправляю файлом.")
 
 
 @router.message(F.photo)
@@ -1044,8 +1274,8 @@ async def handle_photo(message: Message, bot: Bot) -> None:
     # Получаем фото максимального размера
     photo = message.photo[-1]
     
-    # Показываем индикатор
-    await bot.send_chat_action(message.chat.id, "typing")
+    # Показываем индикатор, не дожидаясь ответа Telegram
+    _run_in_background(bot.send_chat_action(message.chat.id, "typing"))
     
     # Скачиваем фото
     file = await bot.get_file(photo.file_id)
@@ -1059,39 +1289,33 @@ async def handle_photo(message: Message, bot: Bot) -> None:
         
         # Если есть подпись - сразу редактируем
         if message.caption:
-            await bot.send_chat_action(message.chat.id, "upload_photo")
-            status_msg = await message.reply("🎨 Редактирую изображение...")
-            
-            result_url, result_text = await edit_image_with_dalle(image_bytes, message.caption)
-            
-            if result_url:
-                try:
-                    # Если это data URL, декодируем
-                    if result_url.startswith("data:"):
-                        import base64
-                        b64_data = result_url.split(",")[1]
-                        edited_bytes = base64.b64decode(b64_data)
-                    else:
-                        # Скачиваем по URL
-                        import aiohttp
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(result_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                                edited_bytes = await resp.read()
-                    
-                    # Сохраняем отредактированное изображение как новое
-                    conversation_manager.set_user_image(user_id, edited_bytes)
-                    
-                    result_photo = BufferedInputFile(edited_bytes, filename="edited.png")
-                    await status_msg.delete()
-                    await message.reply_photo(
-                        photo=result_photo,
-                        caption=f"✅ Готово! Отредактировано по запросу:\n{message.caption[:200]}"
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending edited image: {e}")
-                    await status_msg.edit_text(f"❌ Ошибка: {str(e)[:100]}")
-            else:
-                await status_msg.edit_text(result_text or "❌ Ошибка редактирования")
+            async with ChatActionSender.upload_photo(chat_id=message.chat.id, bot=bot):
+                # Статус отправляем параллельно с запросом к API
+                status_task = asyncio.create_task(message.reply("🎨 Редактирую изображение..."))
+                result_url, result_text = await edit_image_with_dalle(image_bytes, message.caption)
+                status_msg = await status_task
+                
+                if result_url:
+                    try:
+                        # Если это data URL, декодируем
+                        if result_url.startswith("data:"):
+                            b64_data = result_url[result_url.find(",") + 1:]
+                            edited_bytes = await asyncio.to_thread(binascii.a2b_base64, b64_data)
+                        else:
+                            # Скачиваем по URL
+                            edited_bytes = await _download_image(result_url)
+                        
+                        # Сохраняем отредактированное изображение как новое
+                        conversation_manager.set_user_image(user_id, edited_bytes)
+                        
+                        result_photo = BufferedInputFile(edited_bytes, filename="edited.png")
+                        await status_msg.delete()
+                        await _reply_with_image(message, result_photo, _PHOTO_EDIT_CAPTION_TPL % message.caption)
+                    except Exception as e:
+                        logger.error(f"Error sending edited image: {e}")
+                        await status_msg.edit_text(_IMAGE_ERROR_TPL % e)
+                else:
+                    await status_msg.edit_text(result_text or "❌ Ошибка редактирования")
         else:
             await message.reply(
                 "✅ Изображение сохранено!\n\n"
@@ -1102,8 +1326,8 @@ async def handle_photo(message: Message, bot: Bot) -> None:
             )
         return
     
-    # Обычный режим - анализ изображения
-    image_base64 = encode_image_to_base64(image_bytes)
+    # Обычный режим - анализ изображения (кодирование больших фото - вне event loop)
+    image_base64 = await asyncio.to_thread(encode_image_to_base64, image_bytes)
     
     # Определяем MIME-тип
     mime_type = "image/jpeg"
@@ -1111,7 +1335,7 @@ async def handle_photo(message: Message, bot: Bot) -> None:
         mime_type = "image/png"
     
     # Получаем подпись (если есть)
-    user_text = message.caption or "Опиши это изображение подробно."
+    user_text = message.caption or VISION_DEFAULT_PROMPT
     
     # Добавляем в историю
     conversation_manager.add_message(user_id, "user", f"[Изображение] {user_text}", MAX_HISTORY_MESSAGES)
@@ -1139,14 +1363,22 @@ async def handle_document(message: Message, bot: Bot) -> None:
         file_name = document.file_name or "document"
         
         # Проверяем формат файла
-        supported_formats = ('.pdf', '.docx', '.txt')
-        if not any(file_name.lower().endswith(ext) for ext in supported_formats):
+        ext = os.path.splitext(file_name)[1].lower()
+        if ext not in _SUPPORTED_DOC_EXTS:
             await message.reply(
                 "⚠️ Поддерживаются форматы: PDF, DOCX, TXT\n"
                 "Отправь документ в одном из этих форматов."
             )
             return
         
+        # Bot API не отдаёт файлы больше 20 МБ - отказываем до скачивания
+        if document.file_size and document.file_size > _MAX_DOC_BYTES:
+            await message.reply(
+                f"⚠️ Файл слишком большой ({document.file_size // (1024 * 1024)} МБ).\n"
+                f"Максимальный размер: {_MAX_DOC_BYTES // (1024 * 1024)} МБ."
+            )
+            return
+        
         # Показываем индикатор загрузки
         status_msg = await message.reply("📥 Загружаю файл...")
         
@@ -1157,16 +1389,16 @@ async def handle_document(message: Message, bot: Bot) -> None:
             file_bytes = file_data.read()
         except Exception as e:
             logger.error(f"Error downloading document: {e}")
-            await status_msg.edit_text(f"❌ Ошибка загрузки файла: {str(e)[:100]}")
+            await status_msg.edit_text(_DOC_DOWNLOAD_ERROR_TPL % e)
             return
         
         # === РЕЖИМ ШАБЛОНОВ ===
         if conversation_manager.is_template_mode(user_id):
-            if not file_name.lower().endswith('.docx'):
+            if ext != '.docx':
                 await status_msg.edit_text(
-                    "❌ В режиме шаблонов поддерживается только **DOCX**!\n\n"
+                    "❌ В режиме шаблонов поддерживается только <b>DOCX</b>!\n\n"
                     "Отправь документ Word (.docx)",
-                    parse_mode="Markdown"
+                    parse_mode=ParseMode.HTML
                 )
                 return
             
@@ -1175,19 +1407,19 @@ async def handle_document(message: Message, bot: Bot) -> None:
             
             # Получаем структуру документа для показа пользователю
             doc_structure = await get_docx_structure_for_ai(file_bytes)
+            conversation_manager.set_template_structure(user_id, doc_structure)
             
             # Обрезаем если слишком длинный
-            if len(doc_structure) > 2000:
-                doc_structure = doc_structure[:2000] + "\n\n[... документ обрезан для превью ...]"
+            preview = _cap(doc_structure, 1500, "\n\n[... документ обрезан для превью ...]")
             
             await status_msg.edit_text(
-                f"✅ **Шаблон загружен:** `{file_name}`\n\n"
-                f"📄 **Содержимое:**\n```\n{doc_structure[:1500]}\n```\n\n"
-                "🔧 **Теперь опиши что нужно заменить:**\n"
-                "• _\"Замени [старый текст] на [новый текст]\"_\n"
-                "• _\"Измени ООО Ромашка на ООО Василёк\"_\n"
-                "• _\"Поменяй дату 01.01.2025 на 15.03.2026\"_",
-                parse_mode="Markdown"
+                f"✅ <b>Шаблон загружен:</b> <code>{html.escape(file_name)}</code>\n\n"
+                f"📄 <b>Содержимое:</b>\n<pre>{html.escape(preview)}</pre>\n\n"
+                "🔧 <b>Теперь опиши что нужно заменить:</b>\n"
+                "• <i>\"Замени [старый текст] на [новый текст]\"</i>\n"
+                "• <i>\"Измени ООО Ромашка на ООО Василёк\"</i>\n"
+                "• <i>\"Поменяй дату 01.01.2025 на 15.03.2026\"</i>",
+                parse_mode=ParseMode.HTML
             )
             return
         
@@ -1195,7 +1427,7 @@ async def handle_document(message: Message, bot: Bot) -> None:
         await status_msg.edit_text("⚙️ Обрабатываю файл...")
         
         # Извлекаем текст
-        extracted_text = await extract_text_from_file(file_bytes, file_name)
+        extracted_text = await extract_text_from_file(file_bytes, file_name, _MAX_DOC_CHARS)
         
         if not extracted_text or extracted_text.startswith("Ошибка"):
             error_text = extracted_text or "Не удалось извлечь текст"
@@ -1203,14 +1435,13 @@ async def handle_document(message: Message, bot: Bot) -> None:
             return
         
         # Обрезаем текст, если он слишком длинный (увеличили лимит)
-        max_chars = 100000
-        if len(extracted_text) > max_chars:
-            extracted_text = extracted_text[:max_chars] + "\n\n[... текст обрезан ...]"
+        if len(extracted_text) > _MAX_DOC_CHARS:
+            extracted_text = extracted_text[:_MAX_DOC_CHARS] + "\n\n[... текст обрезан ...]"
         
         # Добавляем в историю КАК КЕЙС (не как сообщение пользователя, чтобы бот не отвечал сам себе)
         # Но мы хотим, чтобы бот знал контекст. 
         # Сохраняем это как сообщение пользователя с пометкой
-        conversation_manager.add_message(user_id, "user", f"[Документ: {file_name}]\n{extracted_text}", MAX_HISTORY_MESSAGES)
+        doc_message = ("user", f"[Документ: {file_name}]\n{extracted_text}")
         
         # Проверяем, был ли вопрос (caption)
         user_question = message.caption
@@ -1218,10 +1449,10 @@ async def handle_document(message: Message, bot: Bot) -> None:
         if user_question:
             # Если есть вопрос - отвечаем на него
             await status_msg.edit_text("Ищу ответ на Ваш вопрос...")
-            await bot.send_chat_action(message.chat.id, "typing")
+            _run_in_background(bot.send_chat_action(message.chat.id, "typing"))
             
-            # Добавляем вопрос пользователя в историю ОТДЕЛЬНО
-            conversation_manager.add_message(user_id, "user", user_question, MAX_HISTORY_MESSAGES)
+            # Документ и вопрос пользователя - отдельными сообщениями, одним сохранением
+            conversation_manager.add_messages(user_id, [doc_message, ("user", user_question)], MAX_HISTORY_MESSAGES)
             
             # Получаем историю и модель
             messages = conversation_manager.get_messages_for_api(user_id, SYSTEM_PROMPT)
@@ -1237,8 +1468,9 @@ async def handle_document(message: Message, bot: Bot) -> None:
             await send_response_edit(status_msg, message, response, show_docx_button=True)
         else:
             # Если вопроса нет - подтверждаем реакцией
+            conversation_manager.add_message(user_id, *doc_message, MAX_HISTORY_MESSAGES)
             await status_msg.delete()
-            await add_heart_reaction(message, bot)
+            _run_in_background(add_heart_reaction(message, bot))
 
     except Exception as e:
         logger.error(f"Unhandled error in handle_document: {e}")
@@ -1250,20 +1482,22 @@ async def handle_document(message: Message, bot: Bot) -> None:
 
 async def send_response_edit(status_msg: Message, original_msg: Message, response: str, show_docx_button: bool = False) -> None:
     """Редактирует статусное сообщение с финальным ответом"""
-    from aiogram.enums import ParseMode
-    
     if len(response) <= MAX_TELEGRAM_MESSAGE_LENGTH:
         try:
-            html_response = convert_markdown_to_html(response)
+            # Текст без разметки отправляем как есть
+            if _MD_SIGILS_RE.search(response):
+                text, parse_mode = convert_markdown_to_html(response), ParseMode.HTML
+            else:
+                text, parse_mode = response, None
             
             keyboard = None
             if show_docx_button:
                 # Сохраняем ответ в кэш для возможной конвертации
-                response_id = str(uuid.uuid4())
-                RESPONSE_CACHE[response_id] = response
+                response_id = uuid.uuid4().hex
+                RESPONSE_CACHE.set(response_id, response)
                 keyboard = get_convert_docx_keyboard(response_id)
             
-            await status_msg.edit_text(html_response, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+            await status_msg.edit_text(text, parse_mode=parse_mode, reply_markup=keyboard)
         except Exception as e:
             logger.warning(f"HTML edit error: {e}")
             try:
@@ -1271,66 +1505,17 @@ async def send_response_edit(status_msg: Message, original_msg: Message, respons
             except Exception:
                 # Если редактирование не сработало
                 await status_msg.delete()
-                
-                clean_text = clean_markdown(response)
-                response_id = str(uuid.uuid4())
-                RESPONSE_CACHE[response_id] = clean_text
-                
-                try:
-                    # Создаем DOCX с форматированием
-                    docx_bytes = convert_markdown_to_docx(response)
-                    file = BufferedInputFile(docx_bytes, filename="response.docx")
-                    
-                    await original_msg.reply_document(
-                        document=file,
-                        caption="📄 **Не удалось отправить сообщение**\n"
-                                "Отправляю в формате DOCX (с сохранением форматирования).",
-                        reply_markup=get_txt_download_keyboard(response_id),
-                        parse_mode="Markdown"
-                    )
-                except Exception:
-                     file_bytes = clean_text.encode('utf-8')
-                     file = BufferedInputFile(file_bytes, filename="response.txt")
-                     await original_msg.reply_document(
-                        document=file,
-                        caption="📄 Отправляю файлом."
-                     )
+                await _send_as_document(original_msg, response, _DOCX_FAILED_CAPTION, "📄 Отправляю файлом.")
     else:
         # Ответ слишком длинный
         logger.info(f"Response too long ({len(response)} chars), preparing DOCX")
         await status_msg.delete()
         
-        clean_text = clean_markdown(response)
-        response_id = str(uuid.uuid4())
-        RESPONSE_CACHE[response_id] = clean_text
-        
         try:
-            # Создаем DOCX с форматированием
-            logger.info("Generating DOCX with formatting...")
-            docx_bytes = convert_markdown_to_docx(response)
-            file = BufferedInputFile(docx_bytes, filename="response.docx")
-            
-            logger.info("Sending DOCX...")
-            await original_msg.reply_document(
-                document=file,
-                caption="📄 **Ответ слишком длинный**\n"
-                        "Отправляю в формате DOCX (с сохранением форматирования).",
-                reply_markup=get_txt_download_keyboard(response_id),
-                parse_mode="Markdown"
-            )
-            logger.info("DOCX sent successfully")
+            await _send_as_document(original_msg, response, _DOCX_TOO_LONG_CAPTION,
+                                    "📄 Ответ слишком длинный, отправляю файлом.")
         except Exception as e:
-            logger.error(f"Error sending DOCX: {e}")
-            try:
-                 file_bytes = clean_text.encode('utf-8')
-                 file = BufferedInputFile(file_bytes, filename="response.txt")
-                 await original_msg.reply_document(
-                    document=file,
-                    caption="📄 Ответ слишком длинный, отправляю файлом."
-                 )
-                 logger.info("Fallback TXT sent successfully")
-            except Exception as e2:
-                logger.error(f"Error sending fallback TXT: {e2}")
+            logger.error(f"Error sending response as file: {e}")
 
 
 @router.message(F.voice)
@@ -1349,7 +1534,7 @@ async def handle_voice(message: Message, bot: Bot) -> None:
             audio_bytes = file_data.read()
         except Exception as e:
             logger.error(f"Error downloading voice: {e}")
-            await status_msg.edit_text(f"❌ Ошибка загрузки голосового: {str(e)[:100]}")
+            await status_msg.edit_text(_VOICE_DOWNLOAD_ERROR_TPL % e)
             return
         
         # Транскрибируем
@@ -1362,9 +1547,9 @@ async def handle_voice(message: Message, bot: Bot) -> None:
             return
         
         # Показываем распознанный текст
-        await status_msg.edit_text(f"📝 Распознано: _{transcribed_text}_\n\nИщу ответ на Ваш вопрос...", parse_mode="Markdown")
+        await status_msg.edit_text(f"📝 Распознано: <i>{html.escape(transcribed_text)}</i>\n\nИщу ответ на Ваш вопрос...", parse_mode=ParseMode.HTML)
         
-        await bot.send_chat_action(message.chat.id, "typing")
+        _run_in_background(bot.send_chat_action(message.chat.id, "typing"))
         
         # Добавляем в историю
         conversation_manager.add_message(user_id, "user", transcribed_text, MAX_HISTORY_MESSAGES)
@@ -1394,176 +1579,149 @@ async def handle_voice(message: Message, bot: Bot) -> None:
             pass
 
 
-@router.message(F.text)
-@safe_handler
-async def handle_text(message: Message, bot: Bot, **kwargs) -> None:
-    """Обработчик текстовых сообщений"""
+@router.message(F.text, IsEditMode())
+async def handle_edit_text(message: Message, bot: Bot, **kwargs) -> None:
+    """Обработчик текста в режиме редактирования изображений"""
     user_id = message.from_user.id
     user_text = message.text
     
-    logger.info(f"Received text message from {user_id}: {user_text[:50]}...")
-    
-    # Игнорируем пустые сообщения
-    if not user_text or not user_text.strip():
+    if not user_text.strip():
         return
     
-    # Проверяем режим редактирования
-    if conversation_manager.is_edit_mode(user_id):
-        saved_image = conversation_manager.get_user_image(user_id)
+    saved_image = conversation_manager.get_user_image(user_id)
+    
+    if saved_image:
+        if user_text.strip().lower() in _NOOP_EDITS:
+            await _reply_with_image(message, BufferedInputFile(saved_image, filename="edited.png"), _NOOP_EDIT_CAPTION)
+            return
         
-        if saved_image:
-            # Редактируем сохранённое изображение
-            await bot.send_chat_action(message.chat.id, "upload_photo")
-            status_msg = await message.reply("🎨 Редактирую изображение...")
-            
+        # Редактируем сохранённое изображение
+        async with ChatActionSender.upload_photo(chat_id=message.chat.id, bot=bot):
+            # Статус отправляем параллельно с запросом к API
+            status_task = asyncio.create_task(message.reply("🎨 Редактирую изображение..."))
             result_url, result_text = await edit_image_with_dalle(saved_image, user_text)
+            status_msg = await status_task
             
             if result_url:
                 try:
                     # Если это data URL, декодируем
                     if result_url.startswith("data:"):
-                        import base64
-                        b64_data = result_url.split(",")[1]
-                        edited_bytes = base64.b64decode(b64_data)
+                        b64_data = result_url[result_url.find(",") + 1:]
+                        edited_bytes = await asyncio.to_thread(binascii.a2b_base64, b64_data)
                     else:
                         # Скачиваем по URL
-                        import aiohttp
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(result_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                                edited_bytes = await resp.read()
+                        edited_bytes = await _download_image(result_url)
                     
                     # Сохраняем отредактированное изображение как новое
                     conversation_manager.set_user_image(user_id, edited_bytes)
                     
                     result_photo = BufferedInputFile(edited_bytes, filename="edited.png")
                     await status_msg.delete()
-                    await message.reply_photo(
-                        photo=result_photo,
-                        caption=f"✅ Готово: {user_text[:200]}\n\n💡 Можешь продолжить редактировать или отправить новое фото."
-                    )
+                    await _reply_with_image(message, result_photo, _EDIT_CAPTION_TPL % user_text)
                 except Exception as e:
                     logger.error(f"Error sending edited image: {e}")
                     try:
-                        await status_msg.edit_text(f"❌ Ошибка: {str(e)[:100]}")
+                        await status_msg.edit_text(_IMAGE_ERROR_TPL % e)
                     except Exception:
-                        await message.reply(f"❌ Ошибка: {str(e)[:100]}")
+                        await message.reply(_IMAGE_ERROR_TPL % e)
             else:
                 try:
                     await status_msg.edit_text(result_text or "❌ Ошибка редактирования")
                 except Exception:
                     await message.reply(result_text or "❌ Ошибка редактирования")
-            return
-        else:
-            await message.reply(
-                "📸 Сначала отправь фото для редактирования!\n\n"
-                "Отправь изображение, которое хочешь редактировать."
-            )
-            return
+    else:
+        await message.reply(
+            "📸 Сначала отправь фото для редактирования!\n\n"
+            "Отправь изображение, которое хочешь редактировать."
+        )
+
+
+@router.message(F.text, IsDalleMode())
+async def handle_dalle_text(message: Message, bot: Bot, **kwargs) -> None:
+    """Обработчик текста в DALL-E режиме"""
+    user_id = message.from_user.id
+    user_text = message.text
     
-    # Проверяем DALL-E режим
-    if conversation_manager.is_dalle_mode(user_id):
-        await bot.send_chat_action(message.chat.id, "upload_photo")
-        
+    if not user_text.strip():
+        return
+    
+    async with ChatActionSender.upload_photo(chat_id=message.chat.id, bot=bot):
         # Проверяем, есть ли сохранённое изображение
         saved_dalle_image = conversation_manager.get_dalle_image(user_id)
         
-        if saved_dalle_image:
+        if saved_dalle_image and user_text.strip().lower() in _NOOP_EDITS:
+            await _reply_with_image(message, BufferedInputFile(saved_dalle_image, filename="dalle_edited.png"), _NOOP_EDIT_CAPTION)
+        elif saved_dalle_image:
             # Редактируем существующее изображение
-            status_msg = await message.reply("🎨 Редактирую изображение...")
-            
+            # Статус отправляем параллельно с запросом к API
+            status_task = asyncio.create_task(message.reply("🎨 Редактирую изображение..."))
             result_url, result_text = await edit_image_with_dalle(saved_dalle_image, user_text)
+            status_msg = await status_task
             
             if result_url:
                 try:
                     if result_url.startswith("data:"):
-                        import base64
-                        b64_data = result_url.split(",")[1]
-                        edited_bytes = base64.b64decode(b64_data)
+                        b64_data = result_url[result_url.find(",") + 1:]
+                        edited_bytes = await asyncio.to_thread(binascii.a2b_base64, b64_data)
                     else:
-                        import aiohttp
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(result_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                                edited_bytes = await resp.read()
+                        edited_bytes = await _download_image(result_url)
                     
                     # Сохраняем новое изображение
                     conversation_manager.set_dalle_image(user_id, edited_bytes)
                     
                     result_photo = BufferedInputFile(edited_bytes, filename="dalle_edited.png")
                     await status_msg.delete()
-                    await message.reply_photo(
-                        photo=result_photo,
-                        caption=f"✅ {user_text[:200]}\n\n💡 Продолжай редактировать или напиши новый промпт для новой картинки"
-                    )
+                    await _reply_with_image(message, result_photo, _DALLE_EDIT_CAPTION_TPL % user_text)
                 except Exception as e:
                     logger.error(f"Error sending edited DALL-E image: {e}")
-                    await status_msg.edit_text(f"❌ Ошибка: {str(e)[:100]}")
+                    await status_msg.edit_text(_IMAGE_ERROR_TPL % e)
             else:
                 await status_msg.edit_text(result_text or "❌ Ошибка редактирования")
         else:
             # Генерируем новое изображение
-            status_msg = await message.reply("🖼 Генерирую изображение...")
-            
+            # Статус отправляем параллельно с запросом к API
+            status_task = asyncio.create_task(message.reply("🖼 Генерирую изображение..."))
             image_url, result = await generate_image(user_text)
+            status_msg = await status_task
             
             if image_url:
                 try:
-                    import aiohttp
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(image_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                            if resp.status == 200:
-                                image_data = await resp.read()
-                            else:
-                                raise Exception(f"HTTP {resp.status}")
+                    image_data = await _download_image(image_url)
                     
                     # Сохраняем для последующего редактирования
                     conversation_manager.set_dalle_image(user_id, image_data)
                     
                     photo = BufferedInputFile(image_data, filename="dalle_generated.png")
                     
-                    caption = f"🖼 {user_text[:150]}"
+                    caption = _DALLE_CAPTION_TPL % user_text
                     if result and result != user_text:
-                        caption += f"\n\n📝 Промпт DALL-E: {result[:150]}"
+                        caption += _DALLE_PROMPT_TPL % result
                     caption += "\n\n💡 Напиши что изменить, чтобы отредактировать"
                     
                     await status_msg.delete()
-                    await message.reply_photo(photo=photo, caption=caption)
+                    await _reply_with_image(message, photo, caption)
                     
+                except aiohttp.ClientResponseError as e:
+                    logger.error(f"Error downloading DALL-E image: HTTP {e.status}")
+                    await status_msg.edit_text(f"❌ Не удалось скачать изображение (HTTP {e.status})")
                 except Exception as e:
                     logger.error(f"Error sending DALL-E image: {e}")
-                    await status_msg.edit_text(f"❌ Ошибка: {str(e)[:100]}")
+                    await status_msg.edit_text(_IMAGE_ERROR_TPL % e)
             else:
                 await status_msg.edit_text(result or "❌ Не удалось сгенерировать")
-        return
-    
-    # Проверяем режим шаблонов
-    if conversation_manager.is_template_mode(user_id):
-        template_doc = conversation_manager.get_template_doc(user_id)
-        template_name = conversation_manager.get_template_name(user_id)
-        
-        if not template_doc:
-            await message.reply(
-                "📄 Сначала отправь DOCX документ (шаблон)!\n\n"
-                "Загрузи файл, который хочешь редактировать."
-            )
-            return
-        
-        # Получаем структуру документа для AI
-        status_msg = await message.reply("🔍 Анализирую документ и готовлю замены...")
-        
-        await bot.send_chat_action(message.chat.id, "typing")
-        
-        doc_structure = await get_docx_structure_for_ai(template_doc)
-        if len(doc_structure) > 10000:
-            doc_structure = doc_structure[:10000] + "\n[...обрезано...]"
-        
-        # Промпт для AI чтобы он распарсил замены - УМНЫЙ режим
-        ai_prompt = f"""Ты — умный помощник для редактирования документов. Твоя задача — понять, что хочет пользователь, даже если он выражается неточно или примерно.
+
+
+# Промпт для разбора замен в шаблоне - УМНЫЙ режим.
+# Меняются только документ и запрос, остальное собрано заранее.
+_TEMPLATE_PROMPT_HEAD = """Ты — умный помощник для редактирования документов. Твоя задача — понять, что хочет пользователь, даже если он выражается неточно или примерно.
 
 === ДОКУМЕНТ ===
-{doc_structure}
+"""
+_TEMPLATE_PROMPT_MID = """
 
 === ЗАПРОС ПОЛЬЗОВАТЕЛЯ ===
-{user_text}
+"""
+_TEMPLATE_PROMPT_TAIL = """
 
 === ТВОЯ ЗАДАЧА ===
 Проанализируй документ и пойми, что именно пользователь хочет изменить. Пользователь может:
@@ -1582,107 +1740,196 @@ async def handle_text(message: Message, bot: Bot, **kwargs) -> None:
 4. Создай словарь замен, где ключи — ТОЧНЫЕ строки из документа
 
 ВЕРНИ JSON в формате:
-{{"точный_текст_из_документа_1": "новое_значение_1", "точный_текст_из_документа_2": "новое_значение_2"}}
+{"точный_текст_из_документа_1": "новое_значение_1", "точный_текст_из_документа_2": "новое_значение_2"}
 
 ПРИМЕРЫ:
 - Пользователь: "компанию поменяй на ООО Василёк"
   Документ содержит: "ООО Ромашка", "ООО «Ромашка»"  
-  Ответ: {{"ООО Ромашка": "ООО Василёк", "ООО «Ромашка»": "ООО «Василёк»"}}
+  Ответ: {"ООО Ромашка": "ООО Василёк", "ООО «Ромашка»": "ООО «Василёк»"}
 
 - Пользователь: "дату на 15 марта 2026"
   Документ содержит: "01 января 2025 г.", "01.01.2025"
-  Ответ: {{"01 января 2025 г.": "15 марта 2026 г.", "01.01.2025": "15.03.2026"}}
+  Ответ: {"01 января 2025 г.": "15 марта 2026 г.", "01.01.2025": "15.03.2026"}
 
 - Пользователь: "сумму сделай 500 тысяч"
   Документ содержит: "100 000 (Сто тысяч) рублей"
-  Ответ: {{"100 000 (Сто тысяч) рублей": "500 000 (Пятьсот тысяч) рублей"}}
+  Ответ: {"100 000 (Сто тысяч) рублей": "500 000 (Пятьсот тысяч) рублей"}
 
 - Пользователь: "ФИО преподавателя замени на Дагаев А.В."
   Документ содержит: "Преподаватель: Иванов П.С.", "Иванов Пётр Сергеевич"
-  Ответ: {{"Иванов П.С.": "Дагаев А.В.", "Иванов Пётр Сергеевич": "Дагаев А.В."}}
+  Ответ: {"Иванов П.С.": "Дагаев А.В.", "Иванов Пётр Сергеевич": "Дагаев А.В."}
 
 - Пользователь: "ФИО директора на Петров"
   Документ содержит: "Директор ____________ Сидоров А.А."
-  Ответ: {{"Сидоров А.А.": "Петров А.А."}}
+  Ответ: {"Сидоров А.А.": "Петров А.А."}
 
 - Пользователь: "поменяй студента на Козлов"
   Документ содержит: "Студент группы ИТ-21: Смирнов Алексей Игоревич"
-  Ответ: {{"Смирнов Алексей Игоревич": "Козлов Алексей Игоревич"}}
+  Ответ: {"Смирнов Алексей Игоревич": "Козлов Алексей Игоревич"}
 
 КРИТИЧЕСКИ ВАЖНО:
 - Ключи словаря должны быть ТОЧНЫМИ копиями текста из документа (с пробелами, скобками и т.д.)
 - Отвечай ТОЛЬКО валидным JSON, без пояснений и без markdown
 - Если пользователь говорит расплывчато — используй контекст документа чтобы понять что менять  
 - Ищи ФИО рядом с указанной ролью (преподаватель, студент, директор и т.д.)
-- Если совсем непонятно — верни {{"_error": "Уточни, что именно заменить"}}
+- Если совсем непонятно — верни {"_error": "Уточни, что именно заменить"}
 
 JSON:"""
 
-        # Получаем замены от AI
-        model = conversation_manager.get_user_model(user_id)
-        ai_response = await get_chat_response([
-            {"role": "system", "content": "Ты эксперт по редактированию документов. Ты умеешь понимать неточные запросы пользователя и находить в документе нужные фрагменты для замены. Отвечай ТОЛЬКО валидным JSON."},
-            {"role": "user", "content": ai_prompt}
-        ], model=model)
-        
-        # Логируем ответ AI для отладки
-        logger.info(f"Template AI response: {ai_response[:500]}")
-        
-        # Парсим JSON - улучшенная версия
-        import json
-        import re
-        
-        replacements = None
-        
+# Символы, влияющие на разбор JSON-объекта; остальные пропускаются на уровне C
+_JSON_SCAN_RE = re.compile(r'[{}"\\]')
+
+
+def _extract_json_object(text: str, start: int) -> Optional[str]:
+    """
+    Возвращает сбалансированный JSON-объект, начинающийся с позиции start.
+    
+    Проходит текст один раз, считая глубину скобок и пропуская скобки
+    внутри строковых литералов. None - если объект не закрыт.
+    """
+    depth = 0
+    in_string = False
+    skip_to = start
+    for match in _JSON_SCAN_RE.finditer(text, start):
+        i = match.start()
+        if i < skip_to:
+            # Символ экранирован обратной косой чертой
+            continue
+        ch = text[i]
+        if in_string:
+            if ch == '\\':
+                skip_to = i + 2
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+async def _request_template_replacements(user_id: int, user_text: str, doc_structure: str) -> Optional[dict]:
+    """Просит модель составить словарь замен для шаблона. None - если ответ не разобран"""
+    ai_prompt = _TEMPLATE_PROMPT_HEAD + doc_structure + _TEMPLATE_PROMPT_MID + user_text + _TEMPLATE_PROMPT_TAIL
+
+    # Получаем замены от AI
+    model = conversation_manager.get_user_model(user_id)
+    ai_response = await get_chat_response([
+        {"role": "system", "content": "Ты эксперт по редактированию документов. Ты умеешь понимать неточные запросы пользователя и находить в документе нужные фрагменты для замены. Отвечай ТОЛЬКО валидным JSON."},
+        {"role": "user", "content": ai_prompt}
+    ], model=model)
+    
+    # Логируем ответ AI для отладки
+    logger.info(f"Template AI response: {ai_response[:500]}")
+    
+    # Парсим JSON - улучшенная версия
+    # (orjson.JSONDecodeError наследует json.JSONDecodeError)
+    replacements = None
+    
+    # Способ 1: Напрямую как JSON (пробуем, только если ответ похож на объект)
+    stripped = ai_response.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
         try:
-            # Способ 1: Напрямую как JSON
-            replacements = json.loads(ai_response.strip())
+            replacements = _json_loads(stripped)
         except json.JSONDecodeError:
             pass
+    
+    if replacements is None:
+        try:
+            # Способ 2: Ищем JSON между ``` блоками
+            fence_idx = ai_response.find('```')
+            start_idx = ai_response.find('{', fence_idx) if fence_idx != -1 else -1
+            if start_idx != -1:
+                json_str = _extract_json_object(ai_response, start_idx)
+                if json_str:
+                    replacements = _json_loads(json_str)
+        except json.JSONDecodeError:
+            pass
+    
+    if replacements is None:
+        try:
+            # Способ 3: Ищем любой JSON объект (с вложенностью) от первой {
+            start_idx = ai_response.find('{')
+            if start_idx != -1:
+                json_str = _extract_json_object(ai_response, start_idx)
+                if json_str:
+                    replacements = _json_loads(json_str)
+        except json.JSONDecodeError:
+            pass
+    
+    if replacements is None:
+        logger.error(f"Failed to parse JSON from AI response: {ai_response}")
+    return replacements
+
+
+@router.message(F.text)
+async def handle_text(message: Message, bot: Bot, **kwargs) -> None:
+    """Обработчик текстовых сообщений"""
+    user_id = message.from_user.id
+    user_text = message.text
+    
+    logger.info(f"Received text message from {user_id}: {user_text[:50]}...")
+    
+    # Игнорируем пустые сообщения
+    if not user_text or not user_text.strip():
+        return
+    
+    # Проверяем режим шаблонов
+    if conversation_manager.is_template_mode(user_id):
+        template_doc = conversation_manager.get_template_doc(user_id)
+        template_name = conversation_manager.get_template_name(user_id)
         
-        if replacements is None:
-            try:
-                # Способ 2: Ищем JSON между ``` блоками
-                code_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', ai_response, re.DOTALL)
-                if code_match:
-                    replacements = json.loads(code_match.group(1))
-            except json.JSONDecodeError:
-                pass
+        if not template_doc:
+            await message.reply(
+                "📄 Сначала отправь DOCX документ (шаблон)!\n\n"
+                "Загрузи файл, который хочешь редактировать."
+            )
+            return
         
-        if replacements is None:
-            try:
-                # Способ 3: Ищем любой JSON объект (с вложенностью)
-                # Находим первую { и последнюю }
-                start_idx = ai_response.find('{')
-                end_idx = ai_response.rfind('}')
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = ai_response[start_idx:end_idx + 1]
-                    replacements = json.loads(json_str)
-            except json.JSONDecodeError:
-                pass
+        # Получаем структуру документа для AI
+        status_msg = await message.reply("🔍 Анализирую документ и готовлю замены...")
+        
+        _run_in_background(bot.send_chat_action(message.chat.id, "typing"))
+        
+        # Структура разбирается один раз на версию шаблона
+        full_structure = conversation_manager.get_template_structure(user_id)
+        if full_structure is None:
+            full_structure = await get_docx_structure_for_ai(template_doc)
+            conversation_manager.set_template_structure(user_id, full_structure)
+        doc_structure = _cap(full_structure, 10000, "\n[...обрезано...]")
+        
+        # Простой запрос "замени X на Y", где X дословно есть в документе, разбираем сами
+        replacements = _simple_replacement(user_text, full_structure)
+        if replacements:
+            logger.info(f"Template simple replacement: {replacements}")
+        else:
+            replacements = await _request_template_replacements(user_id, user_text, doc_structure)
         
         if replacements is None:
-            logger.error(f"Failed to parse JSON from AI response: {ai_response}")
             await status_msg.edit_text(
                 "🤔 Не смог разобрать ответ. Попробуй переформулировать:\n\n"
-                f"Твой запрос: _{user_text}_\n\n"
+                f"Твой запрос: <i>{html.escape(user_text)}</i>\n\n"
                 "Примеры:\n"
-                "• _\"ФИО преподавателя замени на Иванов И.И.\"_\n"
-                "• _\"Название компании поменяй на ООО Тест\"_\n"
-                "• _\"Дату сделай 15.03.2026\"_",
-                parse_mode="Markdown"
+                "• <i>\"ФИО преподавателя замени на Иванов И.И.\"</i>\n"
+                "• <i>\"Название компании поменяй на ООО Тест\"</i>\n"
+                "• <i>\"Дату сделай 15.03.2026\"</i>",
+                parse_mode=ParseMode.HTML
             )
             return
         
         # Проверяем на ошибку от AI
         if "_error" in replacements:
             await status_msg.edit_text(
-                f"🤔 {replacements['_error']}\n\n"
+                f"🤔 {html.escape(str(replacements['_error']))}\n\n"
                 "Попробуй сформулировать иначе, например:\n"
-                "• _\"Название компании поменяй на ООО Ромашка\"_\n"
-                "• _\"Дату сделай 15.03.2026\"_\n"
-                "• _\"Сумму измени на 500 000 рублей\"_",
-                parse_mode="Markdown"
+                "• <i>\"Название компании поменяй на ООО Ромашка\"</i>\n"
+                "• <i>\"Дату сделай 15.03.2026\"</i>\n"
+                "• <i>\"Сумму измени на 500 000 рублей\"</i>",
+                parse_mode=ParseMode.HTML
             )
             return
         
@@ -1690,10 +1937,10 @@ JSON:"""
             await status_msg.edit_text(
                 "🤔 Не понял, что нужно заменить.\n\n"
                 "Опиши подробнее, например:\n"
-                "• _\"Поменяй компанию на ООО Тест\"_\n"
-                "• _\"Дату договора сделай 15 марта 2026\"_\n"
-                "• _\"Телефон замени на +7 999 123-45-67\"_",
-                parse_mode="Markdown"
+                "• <i>\"Поменяй компанию на ООО Тест\"</i>\n"
+                "• <i>\"Дату договора сделай 15 марта 2026\"</i>\n"
+                "• <i>\"Телефон замени на +7 999 123-45-67\"</i>",
+                parse_mode=ParseMode.HTML
             )
             return
         
@@ -1712,17 +1959,18 @@ JSON:"""
             doc_file = BufferedInputFile(edited_doc, filename=new_filename)
             
             # Формируем список замен для caption
-            replacements_text = "\n".join([f"• `{old}` → `{new}`" for old, new in list(replacements.items())[:5]])
+            replacements_text = "\n".join(
+                f"• <code>{html.escape(str(old))}</code> → <code>{html.escape(str(new))}</code>"
+                for old, new in itertools.islice(replacements.items(), 5)
+            )
             if len(replacements) > 5:
                 replacements_text += f"\n... и ещё {len(replacements) - 5} замен"
             
             await status_msg.delete()
             await message.reply_document(
                 document=doc_file,
-                caption=f"✅ **Документ отредактирован!**\n\n"
-                        f"📝 **Замены:**\n{replacements_text}\n\n"
-                        f"💡 Можешь загрузить новый шаблон или продолжить редактировать текущий.",
-                parse_mode="Markdown"
+                caption=_TEMPLATE_EDITED_CAPTION_TPL % replacements_text,
+                parse_mode=ParseMode.HTML
             )
             
             # Сохраняем отредактированный как новый шаблон
@@ -1730,15 +1978,15 @@ JSON:"""
             
         except Exception as e:
             logger.error(f"Error editing document: {e}")
-            await status_msg.edit_text(f"❌ Ошибка при редактировании: {str(e)[:100]}")
+            await status_msg.edit_text(_TEMPLATE_EDIT_ERROR_TPL % e)
         
         return
     
-    # Обычный текстовый запрос - показываем анимированный статус
-    status_msg = await message.reply("Ищу ответ на Ваш вопрос...")
+    # Обычный текстовый запрос - статус отправляем в фоне, пока готовим контекст
+    status_task = asyncio.create_task(message.reply("Ищу ответ на Ваш вопрос..."))
     
     logger.info(f"Processing normal text for {user_id}, sending typing action")
-    await bot.send_chat_action(message.chat.id, "typing")
+    _run_in_background(bot.send_chat_action(message.chat.id, "typing"))
     
     # Добавляем сообщение в историю
     conversation_manager.add_message(user_id, "user", user_text, MAX_HISTORY_MESSAGES)
@@ -1761,12 +2009,22 @@ JSON:"""
     history_summary = [f"{m['role']} ({len(m.get('content', ''))} chars)" for m in messages]
     logger.info(f"Context summary: {history_summary}")
     
+    # Ключ кэша: инкрементальный хэш истории + системный промпт
+    # (blake2b, а не hash(): ключ должен совпадать между запусками для дискового кэша)
+    history_digest = conversation_manager.get_history_digest(user_id)
+    if history_digest:
+        prompt_digest = hashlib.blake2b(system_prompt.encode("utf-8"), digest_size=8).hexdigest()
+        cache_key = f"{history_digest}:{prompt_digest}"
+    else:
+        cache_key = None
+    
     # Используем smart_response вместо обычного
-    response = await get_smart_response(user_id, user_text, messages, status_msg)
+    status_msg = await status_task
+    response = await get_smart_response(user_id, user_text, messages, status_msg, cache_key)
     logger.info(f"Received response from OpenAI: {len(response)} chars")
     
     # Добавляем реакцию сердечком на вопрос пользователя
-    await add_heart_reaction(message, bot)
+    _run_in_background(add_heart_reaction(message, bot))
     
     # Сохраняем ответ в историю
     conversation_manager.add_message(user_id, "assistant", response, MAX_HISTORY_MESSAGES)
@@ -1780,7 +2038,7 @@ JSON:"""
 async def convert_to_docx_callback(callback: CallbackQuery):
     """Конвертация ответа в DOCX по кнопке"""
     try:
-        response_id = callback.data.split(":")[2]
+        response_id = callback.data.split(":", 2)[2]
         
         # Пытаемся получить исходный Markdown из кэша
         text_content = RESPONSE_CACHE.get(response_id)
@@ -2,6 +2,8 @@
 Клавиатуры и меню бота
 """
 
+import functools
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from typing import List, Dict
@@ -10,8 +12,11 @@ from conversations import Conversation
 from config import AVAILABLE_MODELS
 
 
+# Клавиатуры без изменяемых параметров строятся один раз и переиспользуются.
+# Разметку после получения не изменяем - экземпляр общий для всех вызовов
+@functools.lru_cache(maxsize=16)
 def get_main_menu_keyboard(is_dalle_mode: bool = False, is_edit_mode: bool = False, is_template_mode: bool = False) -> ReplyKeyboardMarkup:
-    """Главное меню с кнопками. Меняет текст кнопок в зависимости от режима."""
+    """Главное меню с кнопками. Меняет текст кнопок в зависимости от режима (8 вариантов)."""
     builder = ReplyKeyboardBuilder()
     builder.row(
         KeyboardButton(text="📝 Новая беседа"),
@@ -69,6 +74,8 @@ def get_conversations_keyboard(conversations: List[Conversation], active_id: str
     return builder.as_markup()
 
 
+# Клавиатуры для беседы зависят только от conv_id - кэшируем готовую разметку
+@functools.lru_cache(maxsize=1024)
 def get_conversation_actions_keyboard(conv_id: str) -> InlineKeyboardMarkup:
     """Клавиатура действий с беседой"""
     builder = InlineKeyboardBuilder()
@@ -87,6 +94,7 @@ def get_conversation_actions_keyboard(conv_id: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=1024)
 def get_confirm_delete_keyboard(conv_id: str) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения удаления"""
     builder = InlineKeyboardBuilder()
@@ -99,6 +107,7 @@ def get_confirm_delete_keyboard(conv_id: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=1024)
 def get_confirm_clear_keyboard(conv_id: str) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения очистки"""
     builder = InlineKeyboardBuilder()
@@ -111,6 +120,7 @@ def get_confirm_clear_keyboard(conv_id: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=None)
 def get_cancel_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура отмены"""
     builder = InlineKeyboardBuilder()
@@ -118,8 +128,7 @@ def get_cancel_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_models_keyboard(current_model: str) -> InlineKeyboardMarkup:
-    """Клавиатура выбора модели"""
+def _build_models_keyboard(current_model: str = None) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     for model_id, model_name in AVAILABLE_MODELS.items():
@@ -133,6 +142,16 @@ def get_models_keyboard(current_model: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# Набор моделей фиксирован - строим клавиатуру для каждой текущей модели заранее
+_MODELS_KEYBOARDS = {model_id: _build_models_keyboard(model_id) for model_id in AVAILABLE_MODELS}
+_DEFAULT_MODELS_KEYBOARD = _build_models_keyboard()
+
+
+def get_models_keyboard(current_model: str) -> InlineKeyboardMarkup:
+    """Клавиатура выбора модели"""
+    return _MODELS_KEYBOARDS.get(current_model, _DEFAULT_MODELS_KEYBOARD)
+
+
 def get_custom_prompts_keyboard(prompts: list, active_prompt: str = None) -> InlineKeyboardMarkup:
     """Клавиатура управления кастомными промптами"""
     builder = InlineKeyboardBuilder()
@@ -2,10 +2,22 @@
 Клиент для работы с OpenAI API
 """
 
-import base64
+import asyncio
+import hashlib
+import io
+import json
 import logging
-from typing import List, Optional, Tuple
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
+# pybase64 кодирует с SIMD в разы быстрее стандартного base64; без него - stdlib
+try:
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+
+import httpx
 from openai import AsyncOpenAI
 
 from config import (
@@ -14,20 +26,151 @@ from config import (
     OPENAI_VISION_MODEL,
     IMAGE_MODEL,
     MAX_TOKENS,
-    SYSTEM_PROMPT
+    SYSTEM_PROMPT,
+    LOCAL_WHISPER_MODEL,
+    LOCAL_WHISPER_DEVICE,
+    LOCAL_WHISPER_COMPUTE_TYPE,
+    LLM_CACHE_DIR
 )
 
 
 logger = logging.getLogger(__name__)
 
+# HTTP/2 мультиплексирует параллельные запросы в одном соединении;
+# требует пакет h2 (httpx[http2]), без него остаёмся на HTTP/1.1
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# Общий пул соединений: TLS-рукопожатие выполняется один раз, а не на каждый запрос
+_http_client = httpx.AsyncClient(
+    http2=_HTTP2,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+    timeout=httpx.Timeout(600.0, connect=5.0),
+)
+
 # Инициализация клиента OpenAI
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_http_client)
+
+
+async def close_client() -> None:
+    """Закрывает соединения с OpenAI (при остановке бота)"""
+    await client.close()
+
+
+class _LLMFailure(Exception):
+    """Запрос к модели не дал ответа; текст исключения показывается пользователю"""
+
+
+class LLMCache:
+    """
+    TTL/LRU-кэш ответов модели.
+    
+    Хранит задачи, а не готовые строки: одновременные одинаковые запросы
+    ждут один и тот же вызов API. Задачи, завершившиеся исключением
+    (в том числе _LLMFailure) или отменённые, из кэша удаляются, чтобы
+    запрос можно было повторить, а не отдавать из кэша ошибку.
+    """
+    
+    def __init__(self, ttl_seconds: float = 1800, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Tuple[float, asyncio.Task]]" = OrderedDict()
+        # Счётчики для наблюдения за эффективностью кэша
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        entry = self._cache.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def set(self, key: str, task: asyncio.Task) -> None:
+        self._cache[key] = (time.monotonic(), task)
+        self._cache.move_to_end(key)
+        task.add_done_callback(lambda t: self._evict_failed(key, t))
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+    
+    def _evict_failed(self, key: str, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] is task:
+                del self._cache[key]
+
+
+response_cache = LLMCache()
+transcription_cache = LLMCache(ttl_seconds=3600, max_entries=256)
+
+# Дисковый слой под кэшем в памяти (включается через LLM_CACHE_DIR)
+_DISK_CACHE_EXPIRE = 86400
+_disk_cache = None
+if LLM_CACHE_DIR:
+    try:
+        import diskcache
+        _disk_cache = diskcache.Cache(LLM_CACHE_DIR)
+    except ImportError:
+        logger.warning("diskcache is not installed, persistent LLM cache disabled")
+
+
+async def _disk_get(key: str) -> Optional[str]:
+    if _disk_cache is None:
+        return None
+    # diskcache работает через SQLite - не блокируем цикл событий
+    return await asyncio.to_thread(_disk_cache.get, key)
+
+
+async def _disk_set(key: str, value: str) -> None:
+    if _disk_cache is not None:
+        await asyncio.to_thread(_disk_cache.set, key, value, expire=_DISK_CACHE_EXPIRE)
+
+
+# Локальная модель faster-whisper: загружается при первом голосовом сообщении.
+# None - ещё не загружали, False - недоступна (работаем через API)
+_local_whisper = None
+_local_whisper_lock = asyncio.Lock()
+
+
+async def _get_local_whisper():
+    global _local_whisper
+    if _local_whisper is None:
+        async with _local_whisper_lock:
+            if _local_whisper is None:
+                try:
+                    from faster_whisper import WhisperModel
+                    _local_whisper = await asyncio.to_thread(
+                        WhisperModel,
+                        LOCAL_WHISPER_MODEL,
+                        device=LOCAL_WHISPER_DEVICE,
+                        compute_type=LOCAL_WHISPER_COMPUTE_TYPE
+                    )
+                    logger.info(f"Local Whisper model loaded: {LOCAL_WHISPER_MODEL}")
+                except Exception as e:
+                    logger.warning(f"Local Whisper unavailable, using OpenAI API: {e}")
+                    _local_whisper = False
+    return _local_whisper or None
+
+
+def _transcribe_locally(model, audio_bytes: bytes) -> str:
+    segments, _info = model.transcribe(io.BytesIO(audio_bytes), language="ru")
+    # segments - генератор, распознавание идёт по мере его чтения
+    return "".join(segment.text for segment in segments).strip()
 
 
 async def transcribe_audio(audio_bytes: bytes, file_format: str = "ogg") -> str:
     """
     Транскрибирует аудио в текст с помощью Whisper.
     
+    Если задан LOCAL_WHISPER_MODEL и установлен faster-whisper, распознаёт
+    локально; иначе (или при ошибке) - через Whisper API.
+    Повторно присланное аудио (пересланное сообщение, повтор) берётся из кэша.
+    
     Args:
         audio_bytes: Байты аудиофайла
         file_format: Формат файла (ogg, mp3, wav и т.д.)
@@ -35,11 +178,42 @@ async def transcribe_audio(audio_bytes: bytes, file_format: str = "ogg") -> str:
     Returns:
         Распознанный текст
     """
+    key = f"whisper:{hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()}:{file_format}"
+    task = transcription_cache.get(key)
+    if task is None:
+        task = asyncio.create_task(_transcribe_persistent(key, audio_bytes, file_format))
+        transcription_cache.set(key, task)
     try:
-        import io
-        
-        audio_file = io.BytesIO(audio_bytes)
-        audio_file.name = f"audio.{file_format}"
+        return await asyncio.shield(task)
+    except _LLMFailure as e:
+        return str(e)
+
+
+async def _transcribe_persistent(key: str, audio_bytes: bytes, file_format: str) -> str:
+    """Промах кэша в памяти: проверяем диск, затем распознаём"""
+    cached = await _disk_get(key)
+    if cached is not None:
+        return cached
+    
+    # Неудача бросает _LLMFailure, так что на диск попадает только распознанный текст
+    text = await _transcribe_uncached(audio_bytes, file_format)
+    await _disk_set(key, text)
+    return text
+
+
+async def _transcribe_uncached(audio_bytes: bytes, file_format: str) -> str:
+    if LOCAL_WHISPER_MODEL:
+        local_model = await _get_local_whisper()
+        if local_model is not None:
+            try:
+                return await asyncio.to_thread(_transcribe_locally, local_model, audio_bytes)
+            except Exception as e:
+                logger.error(f"Local Whisper error, falling back to API: {e}")
+    
+    try:
+        # Кортеж (имя, байты) SDK отправляет как есть - без копии в BytesIO;
+        # расширение в имени определяет формат
+        audio_file = (f"audio.{file_format}", audio_bytes)
         
         response = await client.audio.transcriptions.create(
             model="whisper-1",
@@ -50,154 +224,347 @@ async def transcribe_audio(audio_bytes: bytes, file_format: str = "ogg") -> str:
         return response.text
     except Exception as e:
         logger.error(f"Whisper error: {e}")
-        return f"❌ Ошибка распознавания: {str(e)}"
+        raise _LLMFailure(f"❌ Ошибка распознавания: {str(e)}") from e
+
+
+def _response_cache_key(
+    messages: List[dict], model: Optional[str], image_base64: Optional[str] = None, image_mime_type: str = ""
+) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    hasher.update(b"\0" + (model or DEFAULT_MODEL).encode("utf-8"))
+    if image_base64:
+        # Части подаём в хэш по отдельности: склейка копировала бы мегабайты base64
+        hasher.update(b"\0")
+        hasher.update(image_mime_type.encode("ascii"))
+        hasher.update(b"\0")
+        hasher.update(image_base64.encode("ascii"))
+    return hasher.hexdigest()
+
+
+# Обработчик промежуточного текста ответа (например, правка статусного сообщения)
+PartialCallback = Callable[[str], Awaitable[None]]
+
+# Как часто передавать промежуточный текст, секунд
+_PARTIAL_INTERVAL = 1.5
+
+# Обработчики промежуточного текста для выполняющихся запросов: одинаковые
+# запросы ждут одну задачу, и каждый ожидающий получает свой промежуточный текст
+_partial_listeners: Dict[asyncio.Task, List[PartialCallback]] = {}
+
+
+def _fan_out_partial(listeners: List[PartialCallback]) -> PartialCallback:
+    async def fan_out(text: str) -> None:
+        await asyncio.gather(*(_report_partial(callback, text) for callback in list(listeners)))
+    return fan_out
 
 
 async def get_chat_response(
     messages: List[dict],
     model: str = None,
     image_base64: Optional[str] = None,
-    image_mime_type: str = "image/jpeg"
+    image_mime_type: str = "image/jpeg",
+    cache_key: Optional[str] = None,
+    on_partial: Optional[PartialCallback] = None
 ) -> str:
     """
     Получает ответ от OpenAI.
     
+    Одинаковые запросы (та же история, модель и изображение) в течение
+    response_cache.ttl_seconds секунд обслуживаются одним вызовом API.
+    
     Args:
         messages: История сообщений в формате OpenAI API
         model: Модель для использования (если None, используется DEFAULT_MODEL)
         image_base64: Base64-закодированное изображение (опционально)
         image_mime_type: MIME-тип изображения
+        cache_key: Готовый ключ истории (например, из get_history_digest),
+            чтобы не сериализовать messages для вычисления ключа
+        on_partial: Вызывается с накопленным текстом по мере генерации
+            (не чаще раза в _PARTIAL_INTERVAL секунд). Это черновик:
+            возвращаемый ответ может отличаться (например, продолжением
+            после обрезки), его и нужно показывать в итоге. Присоединившийся
+            к уже выполняющемуся одинаковому запросу получает текст со
+            следующего обновления. Ответ из кэша и ответ Responses API
+            приходят только целиком, без вызовов on_partial.
         
     Returns:
         Ответ от модели
     """
+    # Ключ считаем до вызова: для изображения последнее сообщение будет изменено
+    if cache_key is not None and not image_base64:
+        key = f"{cache_key}:{model or DEFAULT_MODEL}"
+    else:
+        key = _response_cache_key(messages, model, image_base64, image_mime_type)
+    
+    task = response_cache.get(key)
+    if task is None:
+        listeners: List[PartialCallback] = []
+        task = asyncio.create_task(_get_chat_response_persistent(
+            key, messages, model, image_base64, image_mime_type, _fan_out_partial(listeners)
+        ))
+        _partial_listeners[task] = listeners
+        task.add_done_callback(_partial_listeners.pop)
+        response_cache.set(key, task)
+    
+    listeners = _partial_listeners.get(task)
+    if on_partial is not None and listeners is not None:
+        listeners.append(on_partial)
+    
+    # shield: отмена одного ожидающего не должна отменять общий запрос
+    try:
+        return await asyncio.shield(task)
+    except _LLMFailure as e:
+        return str(e)
+    finally:
+        # Ушедший ожидающий (например, отменённый) больше не получает промежуточный текст
+        if on_partial is not None and listeners is not None and on_partial in listeners:
+            listeners.remove(on_partial)
+
+
+async def _get_chat_response_persistent(
+    key: str,
+    messages: List[dict],
+    model: Optional[str],
+    image_base64: Optional[str],
+    image_mime_type: str,
+    on_partial: Optional[PartialCallback] = None
+) -> str:
+    """Промах кэша в памяти: проверяем диск, затем обращаемся к API"""
+    cached = await _disk_get(key)
+    if cached is not None:
+        return cached
+    
+    # Неудача бросает _LLMFailure, так что на диск попадает только настоящий ответ
+    result = await _get_chat_response_uncached(messages, model, image_base64, image_mime_type, on_partial)
+    await _disk_set(key, result)
+    return result
+
+
+# Вопрос к изображению, если пользователь прислал фото без подписи
+VISION_DEFAULT_PROMPT = "Опиши это изображение подробно."
+
+
+def _attach_image(messages: List[dict], image_base64: str, image_mime_type: str) -> List[dict]:
+    """
+    Возвращает копию messages с изображением в последнем сообщении.
+    
+    Список вызывающего и предыдущие сообщения не изменяются, чтобы
+    префикс запроса (системный промпт и история) оставался прежним.
+    """
+    last_msg = dict(messages[-1])
+    
+    last_msg["content"] = [
+        {
+            "type": "text",
+            "text": last_msg.get("content") or VISION_DEFAULT_PROMPT
+        },
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{image_mime_type};base64,{image_base64}"
+            }
+        }
+    ]
+    return messages[:-1] + [last_msg]
+
+
+async def _chat_responses(messages: List[dict], use_model: str) -> str:
+    """Запрос через Responses API (для gpt-5.2-pro)"""
+    # Преобразуем messages в формат input для responses
+    input_messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+    
+    response = await client.responses.create(
+        model=use_model,
+        input=input_messages,
+        reasoning={"effort": "medium"}
+    )
+    
+    # Извлекаем текст из response: первый output_text из сообщений
+    text = next(
+        (
+            content_item.text
+            for item in (response.output or ())
+            if item.type == "message"
+            for content_item in (item.content or ())
+            if content_item.type == "output_text"
+        ),
+        None
+    )
+    if text is None:
+        raise _LLMFailure("Не удалось получить ответ")
+    return text
+
+
+async def _report_partial(on_partial: PartialCallback, text: str) -> None:
+    # Ошибка показа промежуточного текста не должна прерывать генерацию
+    try:
+        await on_partial(text)
+    except Exception as e:
+        logger.warning(f"Partial response callback failed: {e}")
+
+
+async def _chat_completions(messages: List[dict], use_model: str, on_partial: Optional[PartialCallback] = None) -> str:
+    """Запрос через Chat Completions API с продолжением обрезанных ответов"""
+    logger.info("Using standard Chat Completions API")
+    
+    # Промежуточный текст отправляем в фоне, чтобы не задерживать чтение потока;
+    # следующий - только когда предыдущий отправлен
+    loop = asyncio.get_running_loop()
+    partial_task = None
+    last_partial = loop.time()
+    
+    try:
+        # Логика повторных попыток и продолжения генерации (Auto-Continue)
+        full_content = ""
+        # Список вызывающего не копируем, пока не понадобится его изменить
+        current_messages = messages
+    
+        # Максимум 3 итерации для продолжения (чтобы не зациклиться)
+        for loop_i in range(3):
+            # Если это ретрай из-за переполнения контекста (пустой ответ + length)
+            # То перед запросом попробуем подрезать историю (удалить самое старое сообщение пользователя, кроме первого)
+            if loop_i > 0 and len(full_content) == 0:
+                 logger.warning("Pruning context to fit token limit...")
+                 # Оставляем системный
+                 sys_msg = [m for m in current_messages if m['role'] == 'system']
+                 other_msgs = [m for m in current_messages if m['role'] != 'system']
+    
+                 # Удаляем старые, но оставляем последний (запрос)
+                 if len(other_msgs) > 2:
+                     other_msgs = other_msgs[-2:] # Оставляем только пред-пред и последний
+    
+                 current_messages = sys_msg + other_msgs
+    
+            # Получаем ответ потоком: соединение не простаивает, пока модель
+            # генерирует длинный ответ, а текст собирается по мере поступления
+            stream = await client.chat.completions.create(
+                model=use_model,
+                messages=current_messages,
+                max_completion_tokens=MAX_TOKENS,
+                stream=True
+            )
+    
+            parts = []
+            finish_reason = None
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                    if (on_partial is not None and loop.time() - last_partial >= _PARTIAL_INTERVAL
+                            and (partial_task is None or partial_task.done())):
+                        last_partial = loop.time()
+                        partial_task = asyncio.create_task(
+                            _report_partial(on_partial, full_content + "".join(parts))
+                        )
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+    
+            if not parts and finish_reason is None:
+                if full_content:
+                    return full_content # Вернем что успели, если вдруг ошибка
+                raise _LLMFailure("Не удалось получить ответ")
+    
+            content = "".join(parts)
+    
+            # Добавляем к общему результату
+            full_content += content
+    
+            logger.info(f"OpenAI iteration {loop_i+1}: received {len(content)} chars. Reason: {finish_reason}")
+    
+            # Если успешно завершили - выходим
+            if finish_reason == "stop":
+                logger.info(f"Generation complete. Total: {len(full_content)} chars")
+                return full_content
+    
+            # Если лимит токенов
+            if finish_reason == "length":
+                if not content and not full_content:
+                    # Если совсем ничего не сгенерировали и вылетели по лимиту - значит INPUT слишком большой
+                    # Пробуем следующую итерацию с урезанием (см начало цикла)
+                    logger.warning("Empty content with length limit! Context overflow suspected.")
+                    continue
+    
+                # Если контент ЕСТЬ, но обрезан - надо продолжить
+                logger.info("Output truncated (length). Continuing generation...")
+                if current_messages is messages:
+                    current_messages = list(messages)
+                current_messages.append({"role": "assistant", "content": content})
+                # OpenAI сама продолжит, если подать ей историю с незаконченным ответом? 
+                # Нет, надо явно попросить или просто подать историю
+                # Обычно просто подать историю + ассистентский ответ достаточно, модель продолжит.
+                # Но иногда надо добавить "continue" от юзера. Но лучше просто историю.
+                continue
+    
+            # Другие причины (content_filter и т.д.)
+            if not full_content:
+                logger.warning(f"OpenAI returned empty content with reason: {finish_reason}")
+                raise _LLMFailure(f"Пустой ответ (причина: {finish_reason})")
+    
+            return full_content
+    
+        # Если вышли из цикла по лимиту итераций
+        if not full_content:
+            raise _LLMFailure("Ответ слишком длинный (превышен лимит итераций)")
+        return full_content
+    finally:
+        # Дожидаемся последнего промежуточного текста, чтобы он не перезаписал итоговый ответ
+        if partial_task is not None:
+            await partial_task
+
+
+async def _get_chat_response_uncached(
+    messages: List[dict],
+    model: str = None,
+    image_base64: Optional[str] = None,
+    image_mime_type: str = "image/jpeg",
+    on_partial: Optional[PartialCallback] = None
+) -> str:
+    """Запрос к API без кэша; при неудаче бросает _LLMFailure"""
     try:
-        # Если есть изображение, добавляем его к последнему сообщению
+        # Выбираем путь один раз: изображение -> vision-модель, pro -> Responses API
         if image_base64:
-            # Модифицируем последнее сообщение пользователя
-            last_msg = messages[-1]
-            text_content = last_msg.get("content", "Опиши это изображение подробно.")
-            
-            last_msg["content"] = [
-                {
-                    "type": "text",
-                    "text": text_content if text_content else "Опиши это изображение подробно."
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{image_mime_type};base64,{image_base64}"
-                    }
-                }
-            ]
+            messages = _attach_image(messages, image_base64, image_mime_type)
             use_model = OPENAI_VISION_MODEL
         else:
             use_model = model or DEFAULT_MODEL
         
-        # Проверяем, нужен ли Responses API (для gpt-5.2-pro)
         if use_model == "gpt-5.2-pro":
-            # Используем Responses API
-            # Преобразуем messages в формат input для responses
-            input_messages = []
-            for msg in messages:
-                input_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            response = await client.responses.create(
-                model=use_model,
-                input=input_messages,
-                reasoning={"effort": "medium"}
-            )
-            
-            # Извлекаем текст из response
-            if response.output:
-                for item in response.output:
-                    if item.type == "message" and item.content:
-                        for content_item in item.content:
-                            if content_item.type == "output_text":
-                                return content_item.text
-            return "Не удалось получить ответ"
-        else:
-            # Используем обычный Chat Completions API
-            logger.info("Using standard Chat Completions API")
-            
-            # Логика повторных попыток и продолжения генерации (Auto-Continue)
-            full_content = ""
-            current_messages = list(messages)
-            
-            # Максимум 3 итерации для продолжения (чтобы не зациклиться)
-            for loop_i in range(3):
-                # Если это ретрай из-за переполнения контекста (пустой ответ + length)
-                # То перед запросом попробуем подрезать историю (удалить самое старое сообщение пользователя, кроме первого)
-                if loop_i > 0 and len(full_content) == 0:
-                     logger.warning("Pruning context to fit token limit...")
-                     # Оставляем системный
-                     sys_msg = [m for m in current_messages if m['role'] == 'system']
-                     other_msgs = [m for m in current_messages if m['role'] != 'system']
-                     
-                     # Удаляем старые, но оставляем последний (запрос)
-                     if len(other_msgs) > 2:
-                         other_msgs = other_msgs[-2:] # Оставляем только пред-пред и последний
-                     
-                     current_messages = sys_msg + other_msgs
-                
-                response = await client.chat.completions.create(
-                    model=use_model,
-                    messages=current_messages,
-                    max_completion_tokens=MAX_TOKENS
-                )
-                
-                if not response.choices or len(response.choices) == 0:
-                    if full_content:
-                        return full_content # Вернем что успели, если вдруг ошибка
-                    return "Не удалось получить ответ"
-                    
-                choice = response.choices[0]
-                content = choice.message.content or "" # Если None, то пустая строка
-                finish_reason = choice.finish_reason
-                
-                # Добавляем к общему результату
-                full_content += content
-                
-                logger.info(f"OpenAI iteration {loop_i+1}: received {len(content)} chars. Reason: {finish_reason}")
-                
-                # Если успешно завершили - выходим
-                if finish_reason == "stop":
-                    logger.info(f"Generation complete. Total: {len(full_content)} chars")
-                    return full_content
-                
-                # Если лимит токенов
-                if finish_reason == "length":
-                    if not content and not full_content:
-                        # Если совсем ничего не сгенерировали и вылетели по лимиту - значит INPUT слишком большой
-                        # Пробуем следующую итерацию с урезанием (см начало цикла)
-                        logger.warning("Empty content with length limit! Context overflow suspected.")
-                        continue
-                    
-                    # Если контент ЕСТЬ, но обрезан - надо продолжить
-                    logger.info("Output truncated (length). Continuing generation...")
-                    current_messages.append({"role": "assistant", "content": content})
-                    # OpenAI сама продолжит, если подать ей историю с незаконченным ответом? 
-                    # Нет, надо явно попросить или просто подать историю
-                    # Обычно просто подать историю + ассистентский ответ достаточно, модель продолжит.
-                    # Но иногда надо добавить "continue" от юзера. Но лучше просто историю.
-                    continue
-                    
-                # Другие причины (content_filter и т.д.)
-                if not full_content:
-                    logger.warning(f"OpenAI returned empty content with reason: {finish_reason}")
-                    return f"Пустой ответ (причина: {finish_reason})"
-                    
-                return full_content
-            
-            # Если вышли из цикла по лимиту итераций
-            return full_content if full_content else "Ответ слишком длинный (превышен лимит итераций)"
+            return await _chat_responses(messages, use_model)
+        return await _chat_completions(messages, use_model, on_partial)
         
+    except _LLMFailure:
+        raise
     except Exception as e:
         logger.error(f"OpenAI error: {e}")
-        return f"❌ Ошибка OpenAI: {str(e)}"
+        raise _LLMFailure(f"❌ Ошибка OpenAI: {str(e)}") from e
+
+
+async def get_chat_responses_batch(
+    batch: List[List[dict]],
+    model: str = None,
+    concurrency: int = 5
+) -> List[str]:
+    """
+    Получает ответы на несколько независимых запросов параллельно.
+    
+    Args:
+        batch: Список историй сообщений (по одной на запрос)
+        model: Модель для всех запросов
+        concurrency: Сколько запросов выполнять одновременно
+        
+    Returns:
+        Ответы в том же порядке, что и запросы
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def _one(messages: List[dict]) -> str:
+        async with semaphore:
+            return await get_chat_response(messages, model=model)
+    
+    return await asyncio.gather(*(_one(messages) for messages in batch))
 
 
 async def get_simple_response(user_message: str, model: str = None) -> str:
@@ -248,7 +615,7 @@ def encode_image_to_base64(image_data: bytes) -> str:
     """
     Кодирует изображение в base64.
     """
-    return base64.b64encode(image_data).decode('utf-8')
+    return _b64.b64encode(image_data).decode('ascii')
 
 
 async def edit_image_with_dalle(
@@ -268,11 +635,8 @@ async def edit_image_with_dalle(
         Tuple[url изображения, описание] или (None, error_message)
     """
     try:
-        import io
-        
-        # Создаём file-like объект с правильным именем файла
-        image_file = io.BytesIO(image_bytes)
-        image_file.name = "image.png"  # Устанавливаем имя файла для определения MIME типа
+        # Файл как кортеж (имя, байты, MIME) - без промежуточной копии в BytesIO
+        image_file = ("image.png", image_bytes, "image/png")
         
         # Используем новый API редактирования изображений
         response = await client.images.edit(
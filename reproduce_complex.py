@@ -2,6 +2,9 @@
 from docx_generator import convert_markdown_to_docx
 import markdown
 
+TABLE_SEP_CHARS = frozenset("|-: ")
+MD = markdown.Markdown(extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+
 text = """
 Отчёт по теме: Население США (альтернативная версия — с нумерованными списками)
 1.	Краткое резюме
@@ -29,10 +32,11 @@ text = """
 print("--- DEBUGGING PRE-PROCESSING ---")
 # Manually run the pre-processing logic from docx_generator
 lines = text.split('\n')
+stripped = [line.strip() for line in lines]
 fixed_lines = []
 for i, line in enumerate(lines):
-    if "|" in line and i > 0 and lines[i-1].strip() and not lines[i-1].strip().startswith("|"):
-            if i + 1 < len(lines) and set(lines[i+1].strip()) <= set("|-:| "):
+    if "|" in line and i > 0 and stripped[i-1] and not stripped[i-1].startswith("|"):
+            if i + 1 < len(lines) and TABLE_SEP_CHARS.issuperset(stripped[i+1]):
                 fixed_lines.append("")
     fixed_lines.append(line)
 fixed_text = "\n".join(fixed_lines)
@@ -40,7 +44,7 @@ fixed_text = "\n".join(fixed_lines)
 print(f"Pre-processed text segment around table:\n{fixed_text[fixed_text.find('Таблица'):fixed_text.find('| 1910')]}")
 
 print("\n--- DEBUGGING MARKDOWN TO HTML ---")
-html = markdown.markdown(fixed_text, extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+html = MD.reset().convert(fixed_text)
 if "<table>" in html:
     print("SUCCESS: Table found in HTML.")
 else:
@@ -4,6 +4,10 @@ import re
 from htmldocx import HtmlToDocx
 from docx import Document
 
+# Same pattern as _LIST_NUMBER_RE in docx_generator
+NUM_ESC_RE = re.compile(r'^(\s*)(\d+)\.')
+MD = markdown.Markdown(extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+
 text = """
 Normal text.
 ### 1. This is a header (No blank line before)
@@ -17,13 +21,13 @@ def test_markdown():
     fixed_lines = []
     for line in lines:
         # The list escaping regex
-        line = re.sub(r'^(\s*)(\d+)\.', r'\1\2\\.', line)
+        line = NUM_ESC_RE.sub(r'\1\2\\.', line)
         fixed_lines.append(line)
     
     preprocessed_text = "\n".join(fixed_lines)
     print(f"--- Preprocessed ---\n{preprocessed_text}")
     
-    html = markdown.markdown(preprocessed_text, extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+    html = MD.reset().convert(preprocessed_text)
     print(f"\n--- HTML Output ---\n{html}")
     
     if "<h3>" in html:
@@ -1,6 +1,8 @@
 
 import markdown
 
+MD = markdown.Markdown(extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+
 text = """
 6) Прогнозы (ориентировочно)
 - Краткосрочно (до 2030): рост населения будет медленным...
@@ -14,7 +16,7 @@ text = """
 """
 
 print("--- TESTING ORIGINAL TEXT ---")
-html = markdown.markdown(text, extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+html = MD.reset().convert(text)
 print(html)
 
 if "<table>" not in html:
@@ -25,7 +27,7 @@ else:
 print("\n--- TESTING WITH EXTRA NEWLINE ---")
 # Try adding a newline before the table
 text_fixed = text.replace("Таблица", "\n\nТаблица").replace("| Год", "\n| Год")
-html_fixed = markdown.markdown(text_fixed, extensions=['tables', 'extra', 'fenced_code', 'nl2br'])
+html_fixed = MD.reset().convert(text_fixed)
 # print(html_fixed)
 
 if "<table>" in html_fixed:
@@ -1,7 +1,7 @@
 
 from docx_generator import convert_markdown_to_docx
 import markdown
-from docx import Document
+import docx_inspect
 
 text = """
 Отчёт: Население США
@@ -27,18 +27,19 @@ with open("repro_v2_debug.docx", "wb") as f:
     f.write(docx_bytes)
 
 print("\n--- INSPECTING STYLES AND ELEMENT ORDER ---")
-doc = Document("repro_v2_debug.docx")
-from docx.oxml.text.paragraph import CT_P
-from docx.oxml.table import CT_Tbl
-from docx.text.paragraph import Paragraph
-
-for child in doc.element.body.iterchildren():
-    if isinstance(child, CT_P):
-        p = Paragraph(child, doc)
-        t = p.text.strip()
+# Read document.xml with lxml directly instead of building a python-docx Document
+doc = docx_inspect.parse_part("repro_v2_debug.docx")
+# Style id -> display name, resolved once instead of per paragraph
+style_names = docx_inspect.style_names("repro_v2_debug.docx")
+
+for child in docx_inspect.BODY_CHILDREN_XP(doc):
+    if child.tag == docx_inspect.P_TAG:
+        t = docx_inspect.paragraph_text(child).strip()
         if t:
-            nid = p._element.pPr.numPr.numId.val if p._element.pPr and p._element.pPr.numPr else '-'
-            print(f"P: {t[:10]}... | {p.style.name} | ID:{nid}")
-    elif isinstance(child, CT_Tbl):
+            num_ids = docx_inspect.NUMID_XP(child)
+            nid = num_ids[0] if num_ids else '-'
+            style_ids = docx_inspect.STYLE_XP(child)
+            style = style_names.get(style_ids[0], style_ids[0]) if style_ids else "Normal"
+            print(f"P: {t[:10]}... | {style} | ID:{nid}")
+    elif child.tag == docx_inspect.TBL_TAG:
         print("TABLE")
-
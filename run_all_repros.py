@@ -0,0 +1,83 @@
+"""
+Runs the reproduce_*/verify_*/test_* harness scripts in parallel.
+
+Every script converts its own Markdown fixture with convert_markdown_to_docx,
+which is CPU-bound, so they are spread across a process pool instead of being
+started one by one. Scripts that read another script's output run afterwards.
+"""
+
+import contextlib
+import io
+import os
+import runpy
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Independent scripts: each generates and checks its own DOCX
+SCRIPTS = [
+    "reproduce_complex.py",
+    "reproduce_list.py",
+    "reproduce_v2.py",
+    "test_fix.py",
+    "verify_fix.py",
+    "verify_plain_text_lists.py",
+    "test_docx_gen.py",
+]
+
+# Scripts that inspect files written by SCRIPTS (test_lists.docx from reproduce_list.py)
+DEPENDENT_SCRIPTS = [
+    "verify_lists_xml.py",
+]
+
+
+def _warm_markdown():
+    # Import the generator and build the worker's Markdown instance once,
+    # before any script runs in this process
+    try:
+        import docx_generator
+        docx_generator._get_markdown()
+    except ImportError:
+        # Missing dependencies are reported by the scripts themselves
+        pass
+
+
+def _run_one(name):
+    output = io.StringIO()
+    ok = True
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            runpy.run_path(os.path.join(HERE, name), run_name="__main__")
+        except SystemExit as e:
+            ok = e.code in (None, 0)
+        except Exception as e:
+            print(f"UNHANDLED ERROR: {e!r}")
+            ok = False
+    return name, ok, output.getvalue()
+
+
+def _report(results):
+    failed = 0
+    for name, ok, output in results:
+        print(f"===== {name}: {'OK' if ok else 'FAILED'} =====")
+        print(output)
+        failed += not ok
+    return failed
+
+
+def main():
+    os.chdir(HERE)
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_warm_markdown) as ex:
+        failed = _report(ex.map(_run_one, SCRIPTS))
+        failed += _report(ex.map(_run_one, DEPENDENT_SCRIPTS))
+    
+    print(f"{len(SCRIPTS) + len(DEPENDENT_SCRIPTS) - failed} passed, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
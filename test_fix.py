@@ -2,6 +2,9 @@
 from docx_generator import convert_markdown_to_docx
 import markdown
 
+TABLE_SEP_CHARS = frozenset("|-: ")
+MD = markdown.Markdown(extensions=['tables'])
+
 # Text with missing newline before table
 text = """
 Some paragraph text.
@@ -21,10 +24,11 @@ try:
     # I will trust the logic I added:
     
     lines = text.split('\n')
+    stripped = [line.strip() for line in lines]
     fixed_lines = []
     for i, line in enumerate(lines):
-        if "|" in line and i > 0 and lines[i-1].strip() and not lines[i-1].strip().startswith("|"):
-             if i + 1 < len(lines) and set(lines[i+1].strip()) <= set("|-:| "):
+        if "|" in line and i > 0 and stripped[i-1] and not stripped[i-1].startswith("|"):
+             if i + 1 < len(lines) and TABLE_SEP_CHARS.issuperset(stripped[i+1]):
                  fixed_lines.append("")
         fixed_lines.append(line)
     
@@ -36,7 +40,7 @@ try:
         pass
 
     # Real test: Does markdown see it?
-    html = markdown.markdown(fixed_text, extensions=['tables'])
+    html = MD.reset().convert(fixed_text)
     if "<table>" in html:
         print("VERIFICATION SUCCESS: The patched logic produces valid HTML tables.")
     else:
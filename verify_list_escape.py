@@ -2,6 +2,9 @@
 import markdown
 import re
 
+# Same pattern as _LIST_NUMBER_RE in docx_generator
+NUM_ESC_RE = re.compile(r'^(\s*)(\d+)\.')
+
 text = """
 1. List Item 1
 2. List Item 2
@@ -18,7 +21,7 @@ def preprocess(md):
         # Escape numbering: "1. " -> "1\. "
         # We capture leading whitespace (\s*), the number (\d+), and the dot.
         # We replace with group1 + group2 + "\."
-        new_line = re.sub(r'^(\s*)(\d+)\.', r'\1\2\\.', line)
+        new_line = NUM_ESC_RE.sub(r'\1\2\\.', line)
         new_lines.append(new_line)
     return "\n".join(new_lines)
 
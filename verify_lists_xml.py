@@ -1,7 +1,6 @@
 
-import zipfile
-import re
 import os
+import docx_inspect
 
 docx_path = "test_lists.docx"
 
@@ -11,31 +10,26 @@ if not os.path.exists(docx_path):
 
 print(f"Inspecting {docx_path}...")
 
-with zipfile.ZipFile(docx_path, 'r') as z:
-    # Check numbering.xml
-    try:
-        numbering_xml = z.read('word/numbering.xml').decode('utf-8')
-        print("--- numbering.xml stats ---")
-        num_count = len(re.findall(r'<w:num ', numbering_xml))
-        print(f"Found {num_count} <w:num> definitions.")
-    except KeyError:
-        print("No numbering.xml found!")
-        num_count = 0
-
-    # Check document.xml
-    document_xml = z.read('word/document.xml').decode('utf-8')
-    print("\n--- document.xml stats ---")
-    
-    # Find all numIds used in paragraphs
-    # Pattern: <w:numId w:val="X"/>
-    num_ids = re.findall(r'<w:numId w:val="(\d+)"/>', document_xml)
-    print(f"Found used numIds: {num_ids}")
-    
-    unique_ids = set(num_ids)
-    print(f"Unique numIds used: {unique_ids}")
-    
-    if len(unique_ids) > 1:
-        print("\nSUCCESS: Multiple numbering IDs detected. Lists are likely independent.")
-    else:
-        print("\nFAILURE: Only one numbering ID used. Lists likely continuous.")
+result = docx_inspect.inspect(docx_path)
+
+if result.num_defs is None:
+    print("No numbering.xml found!")
+    num_count = 0
+else:
+    print("--- numbering.xml stats ---")
+    num_count = len(result.num_defs)
+    print(f"Found {num_count} <w:num> definitions.")
+
+# Find all numIds used in paragraphs: <w:numId w:val="X"/>
+print("\n--- document.xml stats ---")
+num_ids = result.num_ids
+print(f"Found used numIds: {num_ids}")
+
+unique_ids = set(num_ids)
+print(f"Unique numIds used: {unique_ids}")
+
+if len(unique_ids) > 1:
+    print("\nSUCCESS: Multiple numbering IDs detected. Lists are likely independent.")
+else:
+    print("\nFAILURE: Only one numbering ID used. Lists likely continuous.")
 